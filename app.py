@@ -1,7 +1,5 @@
 # app.py - Updated for Centralized Approach
 import streamlit as st
-import pandas as pd
-import time
 st.set_page_config(layout="wide", page_title="e-MCM App - GST Audit 1")
 
 # --- Custom Module Imports ---
@@ -9,58 +7,62 @@ from config import MASTER_DRIVE_FOLDER_ID, CENTRALIZED_DAR_UPLOAD_FOLDER_ID, MAS
 from css_styles import load_custom_css
 from google_utils import get_google_services, initialize_drive_structure
 from ui_login import login_page
-from ui_pco import pco_dashboard
-from ui_audit_group import audit_group_dashboard
+# Dashboards (pandas, Gemini, PDF libs) are imported lazily below so the login page paints first
 
 # --- Load CSS ---
 load_custom_css()
 
 # --- Session State Initialization ---
-if 'logged_in' not in st.session_state: st.session_state.logged_in = False
-if 'username' not in st.session_state: st.session_state.username = ""
-if 'role' not in st.session_state: st.session_state.role = ""
-if 'audit_group_no' not in st.session_state: st.session_state.audit_group_no = None
-if 'ag_current_extracted_data' not in st.session_state: st.session_state.ag_current_extracted_data = []
-if 'ag_pdf_drive_url' not in st.session_state: st.session_state.ag_pdf_drive_url = None
-if 'ag_validation_errors' not in st.session_state: st.session_state.ag_validation_errors = []
-if 'ag_editor_data' not in st.session_state: st.session_state.ag_editor_data = pd.DataFrame()
-if 'ag_current_mcm_key' not in st.session_state: st.session_state.ag_current_mcm_key = None
-if 'ag_current_uploaded_file_name' not in st.session_state: st.session_state.ag_current_uploaded_file_name = None
+# Callables are factories for mutable defaults so reruns never share one list between sessions
+_SESSION_DEFAULTS = {
+    'logged_in': False,
+    'username': "",
+    'role': "",
+    'audit_group_no': None,
+    'ag_current_extracted_data': list,
+    'ag_pdf_drive_url': None,
+    'ag_validation_errors': list,
+    'ag_editor_data': None,  # DataFrame built by audit_group_dashboard
+    'ag_editor_has_data': False,  # Set with ag_editor_data so reruns skip the DataFrame.empty check
+    'ag_current_mcm_key': None,
+    'ag_current_uploaded_file_name': None,
+    # For centralized Drive structure - using predefined IDs
+    'master_drive_folder_id': MASTER_DRIVE_FOLDER_ID,
+    'centralized_dar_folder_id': CENTRALIZED_DAR_UPLOAD_FOLDER_ID,
+    'master_dar_database_id': MASTER_DAR_DATABASE_SHEET_ID,
+    'mcm_info_sheet_id': MCM_INFO_SHEET_ID,
+    'drive_structure_initialized': False,
+}
+for _key, _default in _SESSION_DEFAULTS.items():
+    if _key not in st.session_state:
+        st.session_state[_key] = _default() if callable(_default) else _default
 
-# For centralized Drive structure - using predefined IDs
-if 'master_drive_folder_id' not in st.session_state: st.session_state.master_drive_folder_id = MASTER_DRIVE_FOLDER_ID
-if 'centralized_dar_folder_id' not in st.session_state: st.session_state.centralized_dar_folder_id = CENTRALIZED_DAR_UPLOAD_FOLDER_ID
-if 'master_dar_database_id' not in st.session_state: st.session_state.master_dar_database_id = MASTER_DAR_DATABASE_SHEET_ID
-if 'mcm_info_sheet_id' not in st.session_state: st.session_state.mcm_info_sheet_id = MCM_INFO_SHEET_ID
-if 'drive_structure_initialized' not in st.session_state: st.session_state.drive_structure_initialized = False
+def _services_ready(ss) -> bool:
+    """True once both Google API clients are in session state"""
+    return ss.get('drive_service') is not None and ss.get('sheets_service') is not None
 
 # --- Main App Logic ---
 if not st.session_state.logged_in:
     login_page()
 else:
     # Initialize Google Services if not already done
-    if 'drive_service' not in st.session_state or 'sheets_service' not in st.session_state or \
-            st.session_state.drive_service is None or st.session_state.sheets_service is None:
+    if not _services_ready(st.session_state):
         with st.spinner("Initializing Google Services..."):
             st.session_state.drive_service, st.session_state.sheets_service = get_google_services()
-            if st.session_state.drive_service and st.session_state.sheets_service:
+            if _services_ready(st.session_state):
                 st.success("Google Services Initialized.")
                 st.session_state.drive_structure_initialized = False  # Trigger verification
                 st.rerun()
             # Error messages are handled by get_google_services()
 
     # Proceed only if Google services are available
-    if st.session_state.drive_service and st.session_state.sheets_service:
+    if _services_ready(st.session_state):
         # Verify access to pre-created resources instead of creating them
         if not st.session_state.get('drive_structure_initialized'):
             with st.spinner("Verifying access to centralized Google Drive and Sheets resources..."):
                 if initialize_drive_structure(st.session_state.drive_service, st.session_state.sheets_service):
                     st.session_state.drive_structure_initialized = True
-                    st.success("✅ Access verified to centralized resources:")
-                    st.info(f"📁 DAR Upload Folder: `{CENTRALIZED_DAR_UPLOAD_FOLDER_ID}`")
-                    st.info(f"📊 Master Database: `{MASTER_DAR_DATABASE_SHEET_ID}`")
-                    st.info(f"📋 MCM Info Sheet: `{MCM_INFO_SHEET_ID}`")
-                    time.sleep(2)  # Brief pause to show success messages
+                    st.toast("Centralized resources verified", icon="✅")  # Survives the rerun, no blocking pause
                     st.rerun()
                 else:
                     st.error("Failed to verify access to required Google Drive folders and Sheets. Please check service account permissions.")
@@ -71,8 +73,10 @@ else:
         # If verification successful, route to the appropriate dashboard
         if st.session_state.get('drive_structure_initialized'):
             if st.session_state.role == "PCO":
+                from ui_pco import pco_dashboard
                 pco_dashboard(st.session_state.drive_service, st.session_state.sheets_service)
             elif st.session_state.role == "AuditGroup":
+                from ui_audit_group import audit_group_dashboard
                 audit_group_dashboard(st.session_state.drive_service, st.session_state.sheets_service)
             else:
                 st.error("Unknown user role. Please login again.")
@@ -95,4 +99,8 @@ if st.session_state.logged_in and st.session_state.get('drive_structure_initiali
         st.markdown("### 🏛️ Centralized Storage")
         st.caption("All DARs → Single Folder")
         st.caption("All Data → Master Database")
+        with st.expander("Centralized IDs"):
+            st.caption(f"📁 DAR Upload Folder: `{CENTRALIZED_DAR_UPLOAD_FOLDER_ID}`")
+            st.caption(f"📊 Master Database: `{MASTER_DAR_DATABASE_SHEET_ID}`")
+            st.caption(f"📋 MCM Info Sheet: `{MCM_INFO_SHEET_ID}`")
         st.markdown("---")
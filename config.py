@@ -1,6 +1,7 @@
 
 # config.py - Updated for Centralized Approach
 import streamlit as st
+from types import MappingProxyType
 
 # --- Google API Configuration ---
 SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
@@ -17,14 +18,12 @@ MASTER_DRIVE_FOLDER_NAME = "e-MCM App Files"  # For display purposes only
 MCM_PERIODS_FILENAME_ON_DRIVE = "mcm_info"  # For display purposes only
 
 # --- User Credentials ---
-USER_CREDENTIALS = {
-    "planning_officer": "pco_password",
-    **{f"audit_group{i}": f"ag{i}_audit" for i in range(1, 31)}
-}
-USER_ROLES = {
-    "planning_officer": "PCO",
-    **{f"audit_group{i}": "AuditGroup" for i in range(1, 31)}
-}
-AUDIT_GROUP_NUMBERS = {
-    f"audit_group{i}": i for i in range(1, 31)
-}
\ No newline at end of file
+# One read-only record per user: (password, role, audit group number or None)
+_user_records = {"planning_officer": ("pco_password", "PCO", None)}
+_user_records.update({f"audit_group{i}": (f"ag{i}_audit", "AuditGroup", i) for i in range(1, 31)})
+USER_RECORDS = MappingProxyType(_user_records)
+
+# Legacy per-field views (kept for backward compatibility)
+USER_CREDENTIALS = MappingProxyType({user: rec[0] for user, rec in USER_RECORDS.items()})
+USER_ROLES = MappingProxyType({user: rec[1] for user, rec in USER_RECORDS.items()})
+AUDIT_GROUP_NUMBERS = MappingProxyType({user: rec[2] for user, rec in USER_RECORDS.items() if rec[2] is not None})
\ No newline at end of file
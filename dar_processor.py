@@ -1,23 +1,98 @@
 # dar_processor.py
 import pdfplumber
-import google.generativeai as genai
 import json
+import re
+import time
+from io import BytesIO
+
+try:
+    import fitz  # PyMuPDF - optional, much faster text extraction than pdfplumber
+except ImportError:
+    fitz = None
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 from typing import List, Dict, Any
 from models import ParsedDARReport, DARHeaderSchema, AuditParaSchema  # Using your models.py
 
+# Leading ```json / `json and trailing ``` / ` fences around Gemini's JSON, removed in one pass
+_FENCE_RE = re.compile(r'^\s*`{1,3}(?:json)?\s*|\s*`{1,3}\s*$', re.IGNORECASE)
+
+# Pages are extracted one at a time; past this budget the pages read so far are returned with a note
+PDF_EXTRACTION_TIME_BUDGET_SECONDS = 60
+PARTIAL_EXTRACTION_NOTE = "[INFO: Extraction stopped early"
+
+
+def _partial_extraction_note(pages_done: int, page_count: int, reason: str) -> str:
+    return f"\n{PARTIAL_EXTRACTION_NOTE} after {pages_done} of {page_count} pages ({reason})]"
+
 
 def preprocess_pdf_text(pdf_path_or_bytes) -> str:
+    """
+    Extracts all text from all pages of the PDF, using PyMuPDF when it is
+    installed (much faster) and pdfplumber otherwise. Accepts a path,
+    raw bytes or a file-like object.
+    """
+    if fitz is not None:
+        try:
+            return _preprocess_pdf_text_pymupdf(pdf_path_or_bytes)
+        except Exception as e:
+            print(f"PyMuPDF extraction failed, falling back to pdfplumber: {type(e).__name__} - {e}")
+            if hasattr(pdf_path_or_bytes, 'seek'):
+                pdf_path_or_bytes.seek(0)
+    return _preprocess_pdf_text_pdfplumber(pdf_path_or_bytes)
+
+
+def _preprocess_pdf_text_pymupdf(pdf_path_or_bytes) -> str:
+    """Same page-marked output as the pdfplumber path, read straight from the PDF with PyMuPDF."""
+    if isinstance(pdf_path_or_bytes, (bytes, bytearray)):
+        doc = fitz.open(stream=pdf_path_or_bytes, filetype="pdf")
+    elif hasattr(pdf_path_or_bytes, 'read'):
+        doc = fitz.open(stream=pdf_path_or_bytes.read(), filetype="pdf")
+    else:
+        doc = fitz.open(pdf_path_or_bytes)
+
+    processed_text_parts = []
+    started = time.monotonic()
+    with doc:
+        page_count = doc.page_count
+        for i, page in enumerate(doc):
+            if i and time.monotonic() - started > PDF_EXTRACTION_TIME_BUDGET_SECONDS:
+                processed_text_parts.append(_partial_extraction_note(i, page_count, "time budget reached"))
+                break
+            # sort=True orders blocks top-to-bottom, left-to-right (closest to pdfplumber's layout mode)
+            page_text = page.get_text("text", sort=True)
+            if not page_text.strip():
+                page_text = f"[INFO: Page {i + 1} yielded no text directly]"
+            processed_text_parts.append(f"\n--- PAGE {i + 1} ---\n{page_text}")
+    return "".join(processed_text_parts)
+
+
+def _preprocess_pdf_text_pdfplumber(pdf_path_or_bytes) -> str:
     """
     Extracts all text from all pages of the PDF using pdfplumber,
     attempting to preserve layout for better LLM understanding.
     """
+    if isinstance(pdf_path_or_bytes, (bytes, bytearray)):
+        pdf_path_or_bytes = BytesIO(pdf_path_or_bytes)
     processed_text_parts = []
+    pages_done = page_count = 0
+    started = time.monotonic()
     try:
         with pdfplumber.open(pdf_path_or_bytes) as pdf:
+            page_count = len(pdf.pages)
             for i, page in enumerate(pdf.pages):
+                if i and time.monotonic() - started > PDF_EXTRACTION_TIME_BUDGET_SECONDS:
+                    processed_text_parts.append(_partial_extraction_note(i, page_count, "time budget reached"))
+                    break
                 # Using layout=True can help preserve the reading order and structure
                 # which might be beneficial for the LLM.
                 page_text = page.extract_text(x_tolerance=2, y_tolerance=2, layout=True)
+                if hasattr(page, 'close'):
+                    page.close()  # Drop the page's parsed layout objects so only one page is held at a time
 
                 if page_text is None:
                     page_text = f"[INFO: Page {i + 1} yielded no text directly]"
@@ -26,6 +101,7 @@ def preprocess_pdf_text(pdf_path_or_bytes) -> str:
                     page_text = page_text.replace("None", "")
 
                 processed_text_parts.append(f"\n--- PAGE {i + 1} ---\n{page_text}")
+                pages_done = i + 1
 
         full_text = "".join(processed_text_parts)
         # print(f"Full preprocessed text length: {len(full_text)}") # For debugging
@@ -34,6 +110,9 @@ def preprocess_pdf_text(pdf_path_or_bytes) -> str:
     except Exception as e:
         error_msg = f"Error processing PDF with pdfplumber: {type(e).__name__} - {e}"
         print(error_msg)
+        if pages_done:  # Keep the pages read before the failure rather than discarding the whole DAR
+            processed_text_parts.append(_partial_extraction_note(pages_done, page_count, f"{type(e).__name__} - {e}"))
+            return "".join(processed_text_parts)
         return error_msg
 
 
@@ -44,10 +123,12 @@ def get_structured_data_with_gemini(api_key: str, text_content: str) -> ParsedDA
     if text_content.startswith("Error processing PDF with pdfplumber:"):
         return ParsedDARReport(parsing_errors=text_content)
 
-    genai.configure(api_key=api_key)
+    # Shared, cached client (configured once per API key) - keeps the gRPC channel warm across calls.
+    # Imported here so the heavy genai import only happens when actually calling Gemini.
+    from gemini_utils import _get_gemini_model
     # Using a model capable of handling potentially larger context and complex instructions.
     # 'gemini-1.5-flash-latest' is a good balance.
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    model = _get_gemini_model(api_key, 'gemini-1.5-flash-latest')
 
     prompt = f"""
     You are an expert GST audit report analyst. Based on the following FULL text from a Departmental Audit Report (DAR),
@@ -105,24 +186,20 @@ def get_structured_data_with_gemini(api_key: str, text_content: str) -> ParsedDA
     print("\n--- Calling Gemini with simplified full text approach ---")
     # print(f"Prompt (first 500 chars):\n{prompt[:500]}...") # For debugging
 
+    response_text = None  # Set once the call returns; read by the error handlers below
     try:
         response = model.generate_content(prompt)
+        response_text = response.text
 
-        cleaned_response_text = response.text.strip()
-        if cleaned_response_text.startswith("```json"):
-            cleaned_response_text = cleaned_response_text[7:]
-        elif cleaned_response_text.startswith("`json"):
-            cleaned_response_text = cleaned_response_text[6:]
-        if cleaned_response_text.endswith("```"):
-            cleaned_response_text = cleaned_response_text[:-3]
+        cleaned_response_text = _FENCE_RE.sub('', response_text).strip()
 
         if not cleaned_response_text:
             error_message = "Gemini returned an empty response."
             print(error_message)
             return ParsedDARReport(parsing_errors=error_message)
 
-        json_data = json.loads(cleaned_response_text)
-        parsed_report = ParsedDARReport(**json_data)  # Validation against your models.py
+        json_data = _json_loads(cleaned_response_text)
+        parsed_report = ParsedDARReport.model_validate(json_data)  # Validation against your models.py
         print(f"Gemini call successful. Paras found: {len(parsed_report.audit_paras)}")
         if parsed_report.audit_paras:
             for idx, para_obj in enumerate(parsed_report.audit_paras):
@@ -131,16 +208,12 @@ def get_structured_data_with_gemini(api_key: str, text_content: str) -> ParsedDA
                         f"  Note: Para {idx + 1} (Number: {para_obj.audit_para_number}) has a missing heading from Gemini.")
         return parsed_report
     except json.JSONDecodeError as e:
-        raw_response_text = "No response text available"
-        if 'response' in locals() and hasattr(response, 'text'):
-            raw_response_text = response.text
+        raw_response_text = response_text if response_text is not None else "No response text available"
         error_message = f"Gemini output was not valid JSON: {e}. Response: '{raw_response_text[:1000]}...'"
         print(error_message)
         return ParsedDARReport(parsing_errors=error_message)
     except Exception as e:
-        raw_response_text = "No response text available"
-        if 'response' in locals() and hasattr(response, 'text'):
-            raw_response_text = response.text
+        raw_response_text = response_text if response_text is not None else "No response text available"
         error_message = f"Error during Gemini/Pydantic: {type(e).__name__} - {e}. Response: {raw_response_text[:500]}"
         print(error_message)
         return ParsedDARReport(parsing_errors=error_message)
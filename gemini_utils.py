@@ -1,29 +1,460 @@
 # gemini_utils.py - Enhanced with debugging and error handling
 import json
+import re
 import time
-import datetime
+import random
+import threading
+import functools
+import hashlib
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import queue
+import os
 import sys
-import traceback
-from typing import Optional
-from models import ParsedDARReport
+from typing import List, Optional, Tuple
+import streamlit as st
+from pydantic import ValidationError
+from models import ParsedDARReport, DARHeaderSchema, AuditParaSchema
 
-def debug_print(message, level="INFO"):
-    """Print debug messages with timestamp"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [GEMINI-{level}] {message}")
-    sys.stdout.flush()
+# Debug output goes through logging: GEMINI_DEBUG=DEBUG shows the per-step trace,
+# the default (INFO) keeps only errors, so production runs skip the formatting and flushes
+_logger = logging.getLogger(__name__)
+if not _logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("[%(asctime)s] [GEMINI-%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    # Callers only enqueue records; a background listener thread does the stdout writes
+    _log_queue = queue.SimpleQueue()
+    _logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    _log_listener = logging.handlers.QueueListener(_log_queue, _handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    _logger.propagate = False
+_level = logging.getLevelName(os.environ.get("GEMINI_DEBUG", "INFO").upper())
+_logger.setLevel(_level if isinstance(_level, int) else logging.INFO)  # Unknown names map to "Level x" - ignore them
+
+def debug_print(message, level="DEBUG"):
+    """Log a debug trace message (dropped unless GEMINI_DEBUG enables the level)"""
+    _logger.log(logging.getLevelName(level), message)
 
 def debug_exception(e, context=""):
-    """Print detailed exception information"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [GEMINI-ERROR] {context}")
-    print(f"Exception type: {type(e).__name__}")
-    print(f"Exception message: {str(e)}")
-    print("Traceback:")
-    traceback.print_exc()
-    sys.stdout.flush()
-
-def get_structured_data_with_gemini(api_key: str, text_content: str, max_retries=2) -> ParsedDARReport:
+    """Log detailed exception information with traceback"""
+    _logger.error(f"{context}\nException type: {type(e).__name__}\nException message: {str(e)}", exc_info=e)
+
+# Use gemini-1.5-flash for free tier (better than gemini-1.5-flash-latest)
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+MAX_DAR_CHARS = 100000  # Whole-DAR text budget (applied before chunking); above this low-information paragraphs are dropped
+CHARS_PER_TOKEN_ESTIMATE = 4  # Local token estimate (no count_tokens round-trip)
+GEMINI_TIMEOUT_SECONDS = 60  # Per-request cap so a hung call cannot hold a worker indefinitely
+GEMINI_MAX_OUTPUT_TOKENS = 8192  # Increased for larger responses
+DEFAULT_MAX_RETRIES = 2
+GEMINI_CALL_DEADLINE_SECONDS = 300  # Total budget for one DAR across all attempts
+RETRY_WAIT_CAP_SECONDS = 120
+_REQUEST_OPTIONS = {"timeout": GEMINI_TIMEOUT_SECONDS}
+
+# Paragraphs mentioning these carry the header/para facts we extract
+_DAR_KEYWORD_RE = re.compile(r'(GSTIN|Para[-\s]?\d+|Rs\.?|Lakh|recovered|detected|agreed)', re.IGNORECASE)
+_HSPACE_RUN_RE = re.compile(r'[ \t]{2,}')
+_PAGE_NUMBER_RE = re.compile(r'^\s*(?:-\s*)?Page\s+\d+(?:\s*(?:of|/)\s*\d+)?(?:\s*-)?\s*$', re.IGNORECASE)
+_PAGE_SPLIT_RE = re.compile(r'(?=\n--- PAGE \d+ ---\n)')  # Page markers written by preprocess_pdf_text
+RUNNING_HEADER_MIN_REPEATS = 4  # A digit-free line seen this often is a page header/footer
+
+# JSON mode schema mirroring models.ParsedDARReport - Gemini returns bare, valid JSON in this shape
+_NULLABLE_STRING = {"type": "STRING", "nullable": True}
+_NULLABLE_NUMBER = {"type": "NUMBER", "nullable": True}
+_DAR_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "header": {
+            "type": "OBJECT",
+            "nullable": True,
+            "properties": {
+                "audit_group_number": {"type": "INTEGER", "nullable": True, "description": "1 to 30; roman 'Group-VI' becomes 6"},
+                "gstin": _NULLABLE_STRING,
+                "trade_name": _NULLABLE_STRING,
+                "category": {"type": "STRING", "nullable": True, "enum": ["Large", "Medium", "Small"]},
+                "total_amount_detected_overall_rs": {**_NULLABLE_NUMBER, "description": "In Rs, not Lakhs"},
+                "total_amount_recovered_overall_rs": {**_NULLABLE_NUMBER, "description": "In Rs, not Lakhs"},
+            },
+        },
+        "audit_paras": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "audit_para_number": {"type": "INTEGER", "nullable": True, "description": "1 to 50"},
+                    "audit_para_heading": _NULLABLE_STRING,
+                    "revenue_involved_lakhs_rs": {**_NULLABLE_NUMBER, "description": "In Lakhs Rs"},
+                    "revenue_recovered_lakhs_rs": {**_NULLABLE_NUMBER, "description": "In Lakhs Rs"},
+                    "status_of_para": {
+                        "type": "STRING",
+                        "nullable": True,
+                        "enum": ["Agreed and Paid", "Agreed yet to pay", "Partially agreed and paid",
+                                 "Partially agreed, yet to paid", "Not agreed"],
+                    },
+                },
+            },
+        },
+        "parsing_errors": _NULLABLE_STRING,
+    },
+    "required": ["header", "audit_paras"],
+}
+
+# Shared request settings - allocated once per process, passed by reference to every call
+_SAFETY_SETTINGS = [
+    {"category": category, "threshold": "BLOCK_NONE"}
+    for category in ("HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH",
+                     "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT")
+]
+
+@functools.cache
+def _generation_config():
+    """GenerationConfig for DAR extraction, built on first use (keeps genai import lazy)"""
+    import google.generativeai as genai
+    return genai.types.GenerationConfig(
+        candidate_count=1,
+        temperature=0.0,  # Deterministic extraction - same DAR gives the same (cacheable) answer
+        max_output_tokens=GEMINI_MAX_OUTPUT_TOKENS,
+        # Removed stop_sequences to allow full processing
+        response_mime_type="application/json",
+        response_schema=_DAR_RESPONSE_SCHEMA,
+    )
+
+def _retry_wait_seconds(attempt: int) -> float:
+    """Jittered exponential backoff for transient (non-quota) failures, so retries don't collide"""
+    return min(random.uniform(2, 4) * 2 ** (attempt - 1), RETRY_WAIT_CAP_SECONDS)
+
+# Process-wide quota backoff: one 429 pushes back the next request of every user/session
+QUOTA_BACKOFF_CAP_SECONDS = 60
+_RETRY_DELAY_RE = re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)')
+_quota_lock = threading.Lock()
+_next_allowed = 0.0  # time.monotonic() before which no Gemini request should be sent
+
+def _quota_wait_seconds() -> float:
+    """Seconds until the shared quota window reopens (0 if requests are allowed now)"""
+    with _quota_lock:
+        return max(0.0, _next_allowed - time.monotonic())
+
+def _push_back_quota_window(attempt: int, error: Exception) -> float:
+    """Move the shared window after a quota error and return the wait it implies.
+    Uses the server's retry_delay when present, else truncated exponential backoff with jitter."""
+    global _next_allowed
+    match = _RETRY_DELAY_RE.search(str(error))
+    if match:
+        delay = float(match.group(1))
+    else:
+        delay = min(2 ** attempt + random.random(), QUOTA_BACKOFF_CAP_SECONDS)
+    with _quota_lock:
+        now = time.monotonic()
+        _next_allowed = max(_next_allowed, now + delay)
+        return _next_allowed - now
+
+# Proactive free-tier throttle (gemini-1.5-flash): block before sending rather than eat a 429
+GEMINI_RPM_LIMIT = 15
+GEMINI_TPM_LIMIT = 1_000_000
+
+class _RateLimiter:
+    """Sliding 60s window over requests and estimated input tokens, shared by all threads"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._window = deque()  # (monotonic timestamp, estimated tokens) per request sent
+        self._window_tokens = 0
+
+    def acquire(self, estimated_tokens: int) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= 60:
+                    self._window_tokens -= self._window.popleft()[1]
+                # An empty window always admits one request, even if it alone exceeds the TPM estimate
+                if not self._window or (len(self._window) < self.rpm and
+                                        self._window_tokens + estimated_tokens <= self.tpm):
+                    self._window.append((now, estimated_tokens))
+                    self._window_tokens += estimated_tokens
+                    return
+                wait = self._window[0][0] + 60 - now
+            debug_print(f"Rate limiter: window full ({len(self._window)} requests), waiting {wait:.1f} seconds")
+            time.sleep(wait)
+
+_rate_limiter = _RateLimiter(GEMINI_RPM_LIMIT, GEMINI_TPM_LIMIT)
+
+# AIMD concurrency: in-flight Gemini calls grow slowly on fast successes and halve on quota errors
+AIMD_LATENCY_TARGET_SECONDS = 10
+
+class _AIMDLimiter:
+    """Context manager capping in-flight calls at an adaptive ceiling (additive increase, multiplicative decrease)"""
+
+    def __init__(self, initial: float = 4.0, minimum: float = 1.0, maximum: float = 8.0, step: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self._limit = initial
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+        return False
+
+    def increase(self) -> None:
+        with self._cond:
+            self._limit = min(self.maximum, self._limit + self.step)
+            self._cond.notify_all()
+
+    def decrease(self) -> None:
+        with self._cond:
+            self._limit = max(self.minimum, self._limit * 0.5)
+            debug_print(f"AIMD: quota error, concurrency ceiling now {int(self._limit)}")
+
+_concurrency_limiter = _AIMDLimiter()
+
+def _is_retryable(error: Exception) -> bool:
+    """Only transient failures (timeouts, quota, server/connection errors, broken JSON) are worth a retry"""
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, (google_exceptions.DeadlineExceeded, google_exceptions.ResourceExhausted,
+                              google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                              ConnectionError, TimeoutError, json.JSONDecodeError))
+
+def _is_quota_error(error: Exception) -> bool:
+    """429 / RESOURCE_EXHAUSTED, classified by exception type - message text ("generate", "separate") is not a signal"""
+    from google.api_core import exceptions as google_exceptions
+    return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)) or \
+        getattr(error, "code", None) == 429
+
+def _gemini_with_retry(fn, *args, max_attempts: int = 3, **kwargs):
+    """Call fn (e.g. model.generate_content) through the same quota window, RPM/TPM throttle and AIMD
+    limit as extraction; 429/quota errors are retried after the server's retry_delay or jittered
+    exponential backoff, other errors raise at once"""
+    estimated_tokens = sum(len(arg) for arg in args if isinstance(arg, str)) // CHARS_PER_TOKEN_ESTIMATE
+    for attempt in range(1, max_attempts + 1):
+        time.sleep(_quota_wait_seconds())
+        try:
+            return _limited_call(estimated_tokens, fn, *args, **kwargs)
+        except Exception as e:
+            if not _is_quota_error(e) or attempt == max_attempts:
+                raise
+            wait_time = _push_back_quota_window(attempt, e)
+            debug_print(f"Quota error on attempt {attempt}/{max_attempts} - retrying in {wait_time:.1f} seconds")
+
+# Error strings returned by dar_processor.preprocess_pdf_text instead of text
+_ERR_PREFIXES = ("Error processing PDF with pdfplumber:", "Error in preprocess_pdf_text_")
+
+# First attempt uses a terse prompt - the response schema already carries the structure
+_TERSE_PROMPT_PREFIX = (
+    "Extract the GST Departmental Audit Report (DAR) as JSON per the schema: header fields "
+    "(audit_group_number 1-30, gstin, trade_name, category, totals in Rs) and a list of audit_paras "
+    "(audit_para_number 1-50, audit_para_heading, revenues in Lakhs Rs). Use null for missing values.\nDAR Text:\n"
+)
+
+# Full single-DAR prompt, used on retries after a malformed response; only the DAR text is spliced in per call
+_PROMPT_PREFIX = """
+You are an expert GST audit report analyst. Based on the following text from a Departmental Audit Report (DAR),
+extract the specified information and structure it as a JSON object.
+
+The JSON structure is enforced by the response schema; fill every field you can find.
+
+Instructions:
+1. Extract trade_name, gstin, category from the document
+2. Find audit paras with numbers, headings, and amounts
+3. Convert amounts to appropriate units (Lakhs for para amounts)
+4. Use null for missing values
+5. If extraction fails, note in parsing_errors
+
+DAR Text:
+"""
+_PROMPT_SUFFIX = "\n\nRespond with ONLY the JSON object, no explanations.\n"
+
+# Part of the persisted cache key: editing the model, response schema or prompts orphans old disk entries
+_CACHE_SCHEMA_VERSION = hashlib.sha256(json.dumps(
+    [ParsedDARReport.model_json_schema(), _DAR_RESPONSE_SCHEMA, _TERSE_PROMPT_PREFIX, _PROMPT_PREFIX],
+    sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+# Deterministic failures are remembered briefly (not in the persistent cache) so reruns don't re-pay the call;
+# quota failures only until the quota window reopens, transient ones not at all
+NEGATIVE_CACHE_TTL_SECONDS = 120
+_negative_cache = {}  # sha256(api key hash + model + text) -> (expires_at monotonic, failed ParsedDARReport)
+_negative_cache_lock = threading.Lock()  # Chunk workers and concurrent sessions read/prune/insert together
+
+# Singleflight: one Gemini call per identical DAR text in flight, across sessions/threads
+_inflight_lock = threading.Lock()
+_inflight = {}  # same key as _negative_cache -> concurrent.futures.Future[ParsedDARReport]
+SINGLEFLIGHT_WAIT_SECONDS = GEMINI_CALL_DEADLINE_SECONDS + 60  # Leader's deadline plus rate-limiter/AIMD queueing
+
+def _negative_cache_key(api_key: str, text_content: str) -> str:
+    """Scoped to the API key: an auth/billing/quota failure on one key says nothing about another"""
+    api_key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    return hashlib.sha256("\n".join((api_key_hash, GEMINI_MODEL_NAME, text_content)).encode("utf-8")).hexdigest()
+
+class _UncacheableResult(Exception):
+    """Carries a failed ParsedDARReport out of the cached call so it is not stored, with the seconds
+    it may sit in the negative cache (0 for transient failures)"""
+    def __init__(self, report: ParsedDARReport, negative_ttl: float = 0.0):
+        super().__init__(report.parsing_errors)
+        self.report = report
+        self.negative_ttl = negative_ttl
+
+@st.cache_resource(show_spinner=False)
+def _get_gemini_model(api_key: str, model_name: str = GEMINI_MODEL_NAME):
+    """Configure Gemini once per API key and reuse the model across reruns and DARs.
+    The returned model is shared - never mutate it, pass per-call config instead."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+def _limited_call(estimated_tokens: int, fn, *args, **kwargs):
+    """Run fn under the shared RPM/TPM throttle and the AIMD concurrency limit, feeding the
+    limit back (quota error: decrease, fast success: increase). Blocking."""
+    _rate_limiter.acquire(estimated_tokens=estimated_tokens)
+    with _concurrency_limiter:
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if _is_quota_error(e):
+                _concurrency_limiter.decrease()
+            raise
+        if time.monotonic() - started < AIMD_LATENCY_TARGET_SECONDS:
+            _concurrency_limiter.increase()
+        return result
+
+def _generate_streamed_text(model, prompt, **kwargs) -> Optional[str]:
+    """Throttled, concurrency-limited Gemini call - see _stream_json_text.
+    Blocking - run it in a worker thread."""
+    return _limited_call(len(prompt) // CHARS_PER_TOKEN_ESTIMATE, _stream_json_text, model, prompt, **kwargs)
+
+def _is_safety_blocked(chunk) -> bool:
+    """True if a streamed chunk reports a SAFETY block on the prompt or the candidate"""
+    feedback = getattr(chunk, "prompt_feedback", None)
+    if feedback is not None and getattr(feedback, "block_reason", 0):
+        return True
+    return any(getattr(getattr(candidate, "finish_reason", None), "name", "") == "SAFETY"
+               for candidate in getattr(chunk, "candidates", None) or [])
+
+def _stream_json_text(model, prompt, **kwargs) -> Optional[str]:
+    """Stream a Gemini response and return its text as soon as the top-level JSON value closes.
+    Returns None if Gemini gave no response at all."""
+    response = model.generate_content(prompt, stream=True, **kwargs)
+    if not response:
+        return None
+
+    chunks = []
+    depth, in_string, escaped, opened = 0, False, False, False
+    for chunk in response:
+        try:
+            chunk_text = chunk.text
+        except ValueError:  # Chunk without text parts (e.g. finish/safety metadata)
+            if _is_safety_blocked(chunk):
+                debug_print(f"Response blocked for SAFETY after {len(chunks)} chunks - stopping stream")
+                break
+            continue
+        chunks.append(chunk_text)
+
+        # Track brace/bracket depth outside JSON strings to spot the end of the value early
+        for pos, ch in enumerate(chunk_text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+                opened = True
+            elif ch in "}]":
+                depth -= 1
+                if opened and depth <= 0:
+                    break
+        if opened and depth <= 0:
+            # Drop anything after the closing brace in this chunk (trailing chatter breaks strict parsing)
+            chunks[-1] = chunk_text[:pos + 1]
+            debug_print(f"JSON closed after {len(chunks)} streamed chunks - not waiting for stream end")
+            break
+
+    return "".join(chunks)
+
+def _is_boilerplate(text: str) -> bool:
+    """Long enough to matter, with no digits and no DAR keyword - safe to de-duplicate"""
+    return len(text) >= 8 and not any(ch.isdigit() for ch in text) and not _DAR_KEYWORD_RE.search(text)
+
+def _compact_dar_text(text: str, budget: int = MAX_DAR_CHARS) -> str:
+    """Shrink DAR text before it is sent to Gemini.
+    Always drops blank lines, page numbers, repeated running headers/footers and repeated
+    boilerplate paragraphs (digit- and keyword-free), and squeezes whitespace runs; an over-budget document first loses whole pages
+    without any DAR keyword (contents, annexure covers, signature pages - the first page is
+    always kept), then keeps the paragraphs with the most DAR keywords (in original order)."""
+    if len(text) > budget:
+        pages = [page for page in _PAGE_SPLIT_RE.split(text) if page]
+        relevant = [page for i, page in enumerate(pages) if i == 0 or _DAR_KEYWORD_RE.search(page)]
+        if len(relevant) < len(pages):
+            debug_print(f"Dropped {len(pages) - len(relevant)}/{len(pages)} pages without DAR keywords")
+            text = "".join(relevant)
+    blocks = [[_HSPACE_RUN_RE.sub("  ", line).strip() for line in block.splitlines()]
+              for block in re.split(r'\n\s*\n', text)]
+
+    # Running headers/footers: digit-free, keyword-free lines repeated on many pages
+    # (amount rows have digits; status lines like "Agreed and Paid" hit the keyword regex)
+    line_counts = {}
+    for lines in blocks:
+        for line in lines:
+            if _is_boilerplate(line):
+                line_counts[line] = line_counts.get(line, 0) + 1
+    repeated = {line for line, count in line_counts.items() if count >= RUNNING_HEADER_MIN_REPEATS}
+
+    paragraphs, seen_lines, seen_blocks = [], set(), set()
+    for lines in blocks:
+        kept_lines = []
+        for line in lines:
+            if not line or _PAGE_NUMBER_RE.match(line):
+                continue
+            if line in repeated:
+                if line in seen_lines:
+                    continue
+                seen_lines.add(line)
+            kept_lines.append(line)
+        block = "\n".join(kept_lines)
+        if not block:
+            continue
+        # Only boilerplate repeats are dropped - a para's amount/status block can legitimately match another para's
+        if _is_boilerplate(block):
+            if block in seen_blocks:
+                continue
+            seen_blocks.add(block)
+        paragraphs.append(block)
+
+    compacted = "\n\n".join(paragraphs)
+    if len(compacted) <= budget:
+        return compacted
+
+    # Highest-scoring paragraphs first (stable, so ties keep document order), packed into the budget
+    ranked = sorted(range(len(paragraphs)), key=lambda i: len(_DAR_KEYWORD_RE.findall(paragraphs[i])), reverse=True)
+    kept, used = [], 0
+    for i in ranked:
+        cost = len(paragraphs[i]) + 2
+        if used + cost <= budget:
+            kept.append(i)
+            used += cost
+    debug_print(f"Compacted DAR text kept {len(kept)}/{len(paragraphs)} paragraphs ({used}/{len(text)} chars)")
+    return "\n\n".join(paragraphs[i] for i in sorted(kept))
+
+def get_structured_data_with_gemini(api_key: str, text_content: str, max_retries=DEFAULT_MAX_RETRIES) -> ParsedDARReport:
     debug_print(f"Starting Gemini processing with API key: {api_key[:10]}... (max_retries: {max_retries})")
     
     # Validate API key
@@ -32,301 +463,428 @@ def get_structured_data_with_gemini(api_key: str, text_content: str, max_retries
         return ParsedDARReport(parsing_errors="Gemini API Key not configured.")
     
     # Check for PDF preprocessing errors
-    if text_content.startswith("Error processing PDF with pdfplumber:") or \
-            text_content.startswith("Error in preprocess_pdf_text_"):
+    if text_content.startswith(_ERR_PREFIXES):
         debug_print(f"ERROR: PDF preprocessing failed - {text_content[:100]}...")
         return ParsedDARReport(parsing_errors=text_content)
 
+    # Validate text content
+    if not text_content or len(text_content.strip()) < 50:
+        debug_print(f"ERROR: Text content too short - length: {len(text_content) if text_content else 0}")
+        return ParsedDARReport(parsing_errors="Text content too short or empty for analysis.")
+
+    # Cleanup only - the MAX_DAR_CHARS budget is applied to the whole DAR by get_structured_data_chunked
+    text_content = _compact_dar_text(text_content, budget=len(text_content))
+
+    # A recent deterministic (or quota) failure for this exact text is returned as-is
+    failure_key = _negative_cache_key(api_key, text_content)
+    with _negative_cache_lock:
+        recent_failure = _negative_cache.get(failure_key)
+    if recent_failure and recent_failure[0] > time.monotonic():
+        debug_print("Returning recent failure for this DAR text (negative cache)")
+        return recent_failure[1]
+
+    # Singleflight: if another session is already extracting this exact text, wait for its result
+    with _inflight_lock:
+        inflight = _inflight.get(failure_key)
+        is_leader = inflight is None
+        if is_leader:
+            inflight = _inflight[failure_key] = Future()
+    if not is_leader:
+        debug_print("Identical DAR text already in flight - waiting for that call")
+        try:
+            return inflight.result(timeout=SINGLEFLIGHT_WAIT_SECONDS)
+        except FutureTimeoutError:
+            debug_print(f"ERROR: In-flight extraction did not finish within {SINGLEFLIGHT_WAIT_SECONDS}s")
+            return ParsedDARReport(parsing_errors=f"Gemini extraction for this DAR is still running after "
+                                                  f"{SINGLEFLIGHT_WAIT_SECONDS}s in another session. Please try again shortly.")
+
+    report = None
+    try:
+        report = _extract_with_caches(api_key, text_content, max_retries, failure_key)
+        return report
+    finally:
+        with _inflight_lock:
+            _inflight.pop(failure_key, None)
+        inflight.set_result(report if report is not None else
+                            ParsedDARReport(parsing_errors="Concurrent Gemini extraction for this DAR failed."))
+
+def _extract_with_caches(api_key: str, text_content: str, max_retries: int, failure_key: str) -> ParsedDARReport:
+    # Same DAR text (re-extract, re-upload, widget reruns) is served from the cache;
+    # failed calls are raised out of the cached function so they are not persisted
+    try:
+        return _gemini_call_cached(api_key, text_content, max_retries, GEMINI_MODEL_NAME, _CACHE_SCHEMA_VERSION)
+    except _UncacheableResult as failed:
+        if failed.negative_ttl <= 0:
+            debug_print("Gemini call failed transiently - not cached")
+            return failed.report
+        debug_print(f"Gemini call failed - remembered for {failed.negative_ttl:.0f}s, not persisted")
+        now = time.monotonic()
+        with _negative_cache_lock:
+            for key in [k for k, (expires_at, _) in _negative_cache.items() if expires_at <= now]:
+                _negative_cache.pop(key, None)
+            _negative_cache[failure_key] = (now + failed.negative_ttl, failed.report)
+        return failed.report
+
+async def get_structured_data_with_gemini_async(api_key: str, text_content: str, max_retries=DEFAULT_MAX_RETRIES) -> ParsedDARReport:
+    """Async entry point - lets callers await several DARs concurrently (e.g. with asyncio.gather)
+    while sharing the same validation and result cache as the sync function"""
+    return await asyncio.to_thread(get_structured_data_with_gemini, api_key, text_content, max_retries)
+
+async def get_structured_data_many_async(api_key: str, texts: List[str], max_concurrency: int = 4,
+                                         max_retries=DEFAULT_MAX_RETRIES) -> List[ParsedDARReport]:
+    """Extract several DARs concurrently, at most max_concurrency in flight.
+    Returns one ParsedDARReport per text, in order; an unexpected exception becomes an error report."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _extract_one(text_content: str) -> ParsedDARReport:
+        async with semaphore:
+            return await get_structured_data_with_gemini_async(api_key, text_content, max_retries)
+
+    results = await asyncio.gather(*(_extract_one(text) for text in texts), return_exceptions=True)
+    reports = []
+    for result in results:
+        if isinstance(result, BaseException):
+            debug_exception(result, "Concurrent Gemini extraction failed")
+            result = ParsedDARReport(parsing_errors=f"Gemini extraction failed: {type(result).__name__} - {str(result)[:200]}")
+        reports.append(result)
+    return reports
+
+def get_structured_data_many(api_key: str, texts: List[str], max_concurrency: int = 4,
+                             max_retries=DEFAULT_MAX_RETRIES) -> List[ParsedDARReport]:
+    """Sync wrapper for Streamlit callbacks"""
+    return asyncio.run(get_structured_data_many_async(api_key, texts, max_concurrency, max_retries))
+
+# --- Chunked extraction ---
+# A long DAR is split into overlapping chunks extracted concurrently; a failed chunk only loses its own paras
+DAR_CHUNK_CHARS = 30000  # Per-chunk text; DARs at or under this go through the single-call path unchanged
+DAR_CHUNK_OVERLAP_CHARS = 1000  # Trailing lines repeated at the start of the next chunk (paras split at a boundary)
+DAR_CHUNK_MAX_CONCURRENCY = 4
+
+def _split_dar_text(text: str, chunk_chars: int = DAR_CHUNK_CHARS,
+                    overlap_chars: int = DAR_CHUNK_OVERLAP_CHARS) -> List[str]:
+    """Pack lines into chunks of up to chunk_chars, each starting with the last overlap_chars
+    of the previous chunk cut at a line start. Lines, not paragraphs, are the unit: a PDF page
+    often arrives as one long paragraph. Oversized lines are sliced."""
+    lines = []
+    for line in text.split("\n"):
+        if len(line) <= chunk_chars:
+            lines.append(line)
+        else:
+            lines.extend(line[i:i + chunk_chars] for i in range(0, len(line), chunk_chars))
+
+    chunks, current, used = [], [], 0
+    for line in lines:
+        if current and used + len(line) + 1 > chunk_chars:
+            chunks.append("\n".join(current))
+            carried, carried_chars = [], 0
+            for previous in reversed(current):
+                if carried_chars + len(previous) + 1 > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_chars += len(previous) + 1
+            if not carried and current[-1]:  # Last line alone is longer than the overlap - carry its tail
+                carried, carried_chars = [current[-1][-overlap_chars:]], min(len(current[-1]), overlap_chars) + 1
+            if carried_chars + len(line) + 1 > chunk_chars:
+                carried, carried_chars = [], 0  # No room for overlap before this line
+            current, used = carried, carried_chars
+        current.append(line)
+        used += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+_CHUNK_TOTAL_FIELDS = {  # header total (Rs) -> per-para amount (Lakhs) it should cover
+    "total_amount_detected_overall_rs": "revenue_involved_lakhs_rs",
+    "total_amount_recovered_overall_rs": "revenue_recovered_lakhs_rs",
+}
+
+def _merge_chunk_reports(reports: List[ParsedDARReport]) -> ParsedDARReport:
+    """One report from per-chunk reports. Paras are keyed on para number (heading when the number is
+    missing) and a para seen in several chunks keeps the first non-null value of each field. Header
+    fields come from the first chunk that has them, except the overall totals: those are kept only if
+    every chunk reporting them agrees and they cover the merged paras, else summed from the paras."""
+    header_fields, merged_paras, errors = {}, {}, []
+    reported_totals = {field: [] for field in _CHUNK_TOTAL_FIELDS}
+    for chunk_no, report in enumerate(reports, 1):
+        if report.parsing_errors:
+            errors.append(f"Chunk {chunk_no}: {report.parsing_errors}")
+        if report.header:
+            for field, value in report.header.model_dump().items():
+                if value is None:
+                    continue
+                if field in reported_totals:
+                    reported_totals[field].append(value)
+                elif header_fields.get(field) is None:
+                    header_fields[field] = value
+        for para in report.audit_paras:
+            if para.audit_para_number is not None:
+                para_key = para.audit_para_number
+            else:
+                para_key = " ".join((para.audit_para_heading or "").split()).lower()
+            para_fields = merged_paras.setdefault(para_key, {})
+            for field, value in para.model_dump().items():
+                if value is not None and para_fields.get(field) is None:
+                    para_fields[field] = value
+
+    paras = [AuditParaSchema(**fields) for fields in merged_paras.values()]
+    for total_field, para_field in _CHUNK_TOTAL_FIELDS.items():
+        para_amounts = [getattr(para, para_field) for para in paras if getattr(para, para_field) is not None]
+        para_total = round(sum(para_amounts) * 100000, 2) if para_amounts else None
+        reported = reported_totals[total_field]
+        consistent = bool(reported) and max(reported) - min(reported) <= 0.01 * max(abs(max(reported)), 1)
+        if consistent and (para_total is None or reported[0] >= 0.99 * para_total):
+            header_fields[total_field] = reported[0]
+        elif para_total is not None:
+            debug_print(f"Chunk totals {reported} for {total_field} do not cover the paras; using {para_total}")
+            header_fields[total_field] = para_total
+        elif reported:
+            header_fields[total_field] = max(reported)
+    return ParsedDARReport(
+        header=DARHeaderSchema(**header_fields) if any(v is not None for v in header_fields.values()) else None,
+        audit_paras=paras,
+        parsing_errors="; ".join(errors) or None
+    )
+
+def get_structured_data_chunked(api_key: str, text_content: str, max_retries=DEFAULT_MAX_RETRIES,
+                                max_concurrency: int = DAR_CHUNK_MAX_CONCURRENCY) -> ParsedDARReport:
+    """Extract one DAR, splitting text longer than DAR_CHUNK_CHARS into overlapping chunks that are
+    extracted concurrently (through the same caches and limiters) and merged into a single report"""
+    if not text_content or text_content.startswith(_ERR_PREFIXES) or len(text_content) <= DAR_CHUNK_CHARS:
+        return get_structured_data_with_gemini(api_key, text_content, max_retries)
+
+    # Header/footer removal and the MAX_DAR_CHARS budget need the whole document, so both run before
+    # splitting: the budget caps the text sent per DAR (about DAR_CHUNK_MAX_CONCURRENCY chunks)
+    compacted = _compact_dar_text(text_content)
+
+    # Fail fast, before any API call: an oversize DAR whose paragraphs each exceed the budget compacts to nothing
+    if len(compacted.strip()) < 50 and len(text_content) > MAX_DAR_CHARS:
+        estimated_tokens = len(text_content) // CHARS_PER_TOKEN_ESTIMATE
+        debug_print(f"ERROR: Input too large - ~{estimated_tokens} tokens, nothing fits in {MAX_DAR_CHARS} chars")
+        return ParsedDARReport(parsing_errors=f"Input too large: ~{estimated_tokens} tokens and no paragraph fits the "
+                                              f"{MAX_DAR_CHARS // CHARS_PER_TOKEN_ESTIMATE}-token budget.")
+    if len(compacted) <= DAR_CHUNK_CHARS:
+        return get_structured_data_with_gemini(api_key, compacted, max_retries)
+
+    chunks = _split_dar_text(compacted)
+    debug_print(f"Extracting DAR in {len(chunks)} chunks ({len(compacted)} chars)")
+    reports = get_structured_data_many(api_key, chunks, max_concurrency, max_retries)
+    if all(report.header is None and not report.audit_paras for report in reports):
+        return ParsedDARReport(parsing_errors=f"All {len(chunks)} chunks failed: " +
+                                              "; ".join(filter(None, (report.parsing_errors for report in reports))))
+    return _merge_chunk_reports(reports)
+
+# persist="disk" keeps extractions across restarts/redeploys (Streamlit ignores ttl for disk caches)
+@st.cache_data(max_entries=2000, persist="disk", show_spinner=False)
+def _gemini_call_cached(api_key: str, text_content: str, max_retries: int, model_name: str,
+                        schema_version: str) -> ParsedDARReport:
+    """Cached wrapper around the Gemini call, keyed on the DAR text, model name and schema version.
+    ParsedDARReport is a plain Pydantic model, so Streamlit can pickle it to disk."""
+    parsed_report, failure_ttl = asyncio.run(_call_gemini_async(api_key, text_content, max_retries, model_name))
+    # Error-only reports (no header, no paras) come from API/parsing failures
+    if parsed_report.header is None and not parsed_report.audit_paras:
+        raise _UncacheableResult(parsed_report, failure_ttl)
+    return parsed_report
+
+async def _call_gemini_async(api_key: str, text_content: str, max_retries: int,
+                             model_name: str) -> Tuple[ParsedDARReport, float]:
+    """Returns the report and, for a failure, how long it may be remembered in the negative cache:
+    NEGATIVE_CACHE_TTL_SECONDS for deterministic failures (schema validation, billing/auth, rejected
+    request), the quota window for quota errors, 0 for transient ones (timeouts, 5xx, empty/broken output)"""
     # Initialize Gemini
+    # google.generativeai is imported once, inside the cached _get_gemini_model
     try:
-        debug_print("Importing google.generativeai")
-        import google.generativeai as genai
-        
-        debug_print("Configuring Gemini API")
-        genai.configure(api_key=api_key)
-        
-        debug_print("Creating model instance (gemini-1.5-flash)")
-        # Use gemini-1.5-flash for free tier (better than gemini-1.5-flash-latest)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
+        model = _get_gemini_model(api_key, model_name)
     except ImportError as e:
         debug_exception(e, "Failed to import google.generativeai")
-        return ParsedDARReport(parsing_errors=f"Failed to import Gemini library: {str(e)}")
+        return ParsedDARReport(parsing_errors=f"Failed to import Gemini library: {str(e)}"), NEGATIVE_CACHE_TTL_SECONDS
     except Exception as e:
         debug_exception(e, "Failed to initialize Gemini")
-        return ParsedDARReport(parsing_errors=f"Failed to initialize Gemini: {str(e)}")
-
-    # Validate text content
-    if not text_content or len(text_content.strip()) < 50:
-        debug_print(f"ERROR: Text content too short - length: {len(text_content) if text_content else 0}")
-        return ParsedDARReport(parsing_errors="Text content too short or empty for analysis.")
+        return ParsedDARReport(parsing_errors=f"Failed to initialize Gemini: {str(e)}"), 0.0
 
-    # Don't truncate - send full text to Gemini
-    # Gemini 1.5 Flash can handle much larger inputs (up to 1M tokens)
+    # Text arrives compacted; get_structured_data_chunked has already held the DAR to MAX_DAR_CHARS
     original_length = len(text_content)
-    debug_print(f"Text length: {original_length} characters - sending full content to Gemini")
-    
-    # For very large texts, we might need to handle them differently, but let's try full text first
-    if original_length > 100000:  # 100K chars
-        debug_print(f"WARNING: Very large text ({original_length} chars). If this fails, consider chunking.")
-        # But still send the full text - don't truncate
-
-    # Prepare prompt
-    prompt = f"""
-    You are an expert GST audit report analyst. Based on the following text from a Departmental Audit Report (DAR),
-    extract the specified information and structure it as a JSON object.
-
-    The JSON object should follow this structure precisely:
-    {{
-      "header": {{
-        "audit_group_number": null,
-        "gstin": "string or null",
-        "trade_name": "string or null",
-        "category": "string or null (Large/Medium/Small)",
-        "total_amount_detected_overall_rs": "float or null",
-        "total_amount_recovered_overall_rs": "float or null"
-      }},
-      "audit_paras": [
-        {{
-          "audit_para_number": "integer or null (1-50)",
-          "audit_para_heading": "string or null",
-          "revenue_involved_lakhs_rs": "float or null (in Lakhs)",
-          "revenue_recovered_lakhs_rs": "float or null (in Lakhs)",
-          "status_of_para": "string or null (Agreed and Paid/Agreed yet to pay/Partially agreed and paid/Partially agreed, yet to paid/Not agreed)"
-        }}
-      ],
-      "parsing_errors": "string or null"
-    }}
-
-    Instructions:
-    1. Extract trade_name, gstin, category from the document
-    2. Find audit paras with numbers, headings, and amounts
-    3. Convert amounts to appropriate units (Lakhs for para amounts)
-    4. Use null for missing values
-    5. If extraction fails, note in parsing_errors
-
-    DAR Text:
-    {text_content}
-
-    Respond with ONLY the JSON object, no explanations.
-    """
-
-    debug_print(f"Prompt prepared - length: {len(prompt)} characters")
+    debug_print(f"Text length: {original_length} characters - sending compacted content to Gemini")
+
+    # Terse prompt first; switch to the full instructions if Gemini returns a malformed report
+    use_full_prompt = False
 
     attempt = 0
     last_exception = None
+    call_started = time.monotonic()
     
     while attempt <= max_retries:
         attempt += 1
         debug_print(f"Attempt {attempt}/{max_retries + 1}")
+
+        # Overall deadline across attempts and waits, so one DAR cannot hold the page for minutes
+        if attempt > 1 and time.monotonic() - call_started > GEMINI_CALL_DEADLINE_SECONDS:
+            debug_print(f"Call deadline of {GEMINI_CALL_DEADLINE_SECONDS}s exceeded - giving up")
+            break
         
         try:
             # Enhanced generation config for larger texts
             debug_print("Sending request to Gemini API")
+
+            if use_full_prompt:
+                prompt = _PROMPT_PREFIX + text_content + _PROMPT_SUFFIX
+            else:
+                prompt = _TERSE_PROMPT_PREFIX + text_content
+            debug_print(f"Prompt prepared ({'full' if use_full_prompt else 'terse'}) - length: {len(prompt)} characters")
             
-            generation_config = genai.types.GenerationConfig(
-                candidate_count=1,
-                temperature=0.1,
-                max_output_tokens=8192,  # Increased for larger responses
-                # Removed stop_sequences to allow full processing
-            )
-            
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
-            ]
-            
-            debug_print(f"Generation config: temperature=0.1, max_tokens=8192")
+            debug_print(f"Generation config: temperature=0.0, max_tokens={GEMINI_MAX_OUTPUT_TOKENS}, JSON mode, timeout={GEMINI_TIMEOUT_SECONDS}s")
+
+            # Another call may have hit the quota - wait for the shared window instead of adding to the 429s
+            quota_wait = _quota_wait_seconds()
+            if quota_wait > 0:
+                debug_print(f"Waiting {quota_wait:.1f} seconds for shared quota window")
+                await asyncio.sleep(quota_wait)
             
-            response = model.generate_content(
+            # Blocking streamed call runs in a worker thread so the event loop stays free
+            response_text = await asyncio.to_thread(
+                _generate_streamed_text,
+                model,
                 prompt,
-                generation_config=generation_config,
-                safety_settings=safety_settings
+                generation_config=_generation_config(),
+                safety_settings=_SAFETY_SETTINGS,
+                request_options=_REQUEST_OPTIONS
             )
             
-            debug_print(f"Response received: {bool(response)}")
+            debug_print(f"Response received: {response_text is not None}")
             
-            if not response:
+            if response_text is None:
                 error_message = f"Gemini returned no response on attempt {attempt}. This might be due to free tier rate limits."
                 debug_print(f"ERROR: {error_message}")
                 last_exception = ValueError(error_message)
                 if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
+                    return ParsedDARReport(parsing_errors=error_message), 0.0
                 # Longer wait for free tier
-                wait_time = 5 + (attempt * 2)
-                debug_print(f"Waiting {wait_time} seconds before retry")
-                time.sleep(wait_time)
+                wait_time = _retry_wait_seconds(attempt)
+                debug_print(f"Waiting {wait_time:.1f} seconds before retry")
+                await asyncio.sleep(wait_time)
                 continue
             
-            if not response.text:
+            if not response_text:
                 error_message = f"Gemini returned empty response.text on attempt {attempt}. This might be due to free tier rate limits."
                 debug_print(f"ERROR: {error_message}")
                 last_exception = ValueError(error_message)
                 if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
+                    return ParsedDARReport(parsing_errors=error_message), 0.0
                 # Longer wait for free tier
-                wait_time = 5 + (attempt * 2)
-                debug_print(f"Waiting {wait_time} seconds before retry")
-                time.sleep(wait_time)
+                wait_time = _retry_wait_seconds(attempt)
+                debug_print(f"Waiting {wait_time:.1f} seconds before retry")
+                await asyncio.sleep(wait_time)
                 continue
             
-            debug_print(f"Response text received - length: {len(response.text)} characters")
-            debug_print(f"Response text preview: {response.text[:200]}...")
-            
-            cleaned_response_text = response.text.strip()
+            if _logger.isEnabledFor(logging.DEBUG):  # Skip building the preview slice when tracing is off
+                debug_print(f"Response text received - length: {len(response_text)} characters")
+                debug_print(f"Response text preview: {response_text[:200]}...")
             
-            # Clean up common markdown formatting
-            debug_print("Cleaning response text")
-            original_cleaned = cleaned_response_text
-            
-            if cleaned_response_text.startswith("```json"):
-                cleaned_response_text = cleaned_response_text[7:]
-                debug_print("Removed ```json prefix")
-            elif cleaned_response_text.startswith("```"):
-                cleaned_response_text = cleaned_response_text[3:]
-                debug_print("Removed ``` prefix")
-            elif cleaned_response_text.startswith("`json"):
-                cleaned_response_text = cleaned_response_text[5:]
-                debug_print("Removed `json prefix")
-            elif cleaned_response_text.startswith("`"):
-                cleaned_response_text = cleaned_response_text[1:]
-                debug_print("Removed ` prefix")
-            
-            if cleaned_response_text.endswith("```"):
-                cleaned_response_text = cleaned_response_text[:-3]
-                debug_print("Removed ``` suffix")
-            elif cleaned_response_text.endswith("`"):
-                cleaned_response_text = cleaned_response_text[:-1]
-                debug_print("Removed ` suffix")
-
-            if not cleaned_response_text:
-                error_message = f"Gemini response was empty after cleaning on attempt {attempt}."
-                debug_print(f"ERROR: {error_message}")
-                debug_print(f"Original response: {original_cleaned}")
-                last_exception = ValueError(error_message)
-                if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
-                wait_time = 5 + attempt
-                debug_print(f"Waiting {wait_time} seconds before retry")
-                time.sleep(wait_time)
-                continue
-
-            debug_print(f"Cleaned response text - length: {len(cleaned_response_text)} characters")
-            debug_print(f"Cleaned response preview: {cleaned_response_text[:200]}...")
-
-            # Try to parse JSON
+            # Parse + validate in one pydantic-core pass; missing header/audit_paras fall back to the model defaults
             try:
-                debug_print("Attempting to parse JSON")
-                json_data = json.loads(cleaned_response_text)
-                debug_print("JSON parsed successfully")
-                debug_print(f"JSON keys: {list(json_data.keys()) if isinstance(json_data, dict) else 'Not a dict'}")
-                
-            except json.JSONDecodeError as json_e:
-                error_message = f"Invalid JSON from Gemini (Attempt {attempt}): {str(json_e)[:200]}..."
-                debug_print(f"ERROR: {error_message}")
-                debug_print(f"Problematic JSON text: {cleaned_response_text[:500]}...")
-                last_exception = json_e
-                if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
-                wait_time = 5 + (attempt * 2)
-                debug_print(f"Waiting {wait_time} seconds before retry")
-                time.sleep(wait_time)
-                continue
-            
-            # Validate JSON structure
-            debug_print("Validating JSON structure")
-            if "header" not in json_data or "audit_paras" not in json_data:
-                error_message = f"Gemini response missing required keys (Attempt {attempt}). Using fallback structure."
-                debug_print(f"WARNING: {error_message}")
-                debug_print(f"Available keys: {list(json_data.keys()) if isinstance(json_data, dict) else 'Not a dict'}")
-                
-                # Create fallback structure
-                if "header" not in json_data:
-                    json_data["header"] = {}
-                    debug_print("Added empty header")
-                if "audit_paras" not in json_data:
-                    json_data["audit_paras"] = []
-                    debug_print("Added empty audit_paras")
-                json_data["parsing_errors"] = error_message
-
-            # Try to create ParsedDARReport
-            try:
-                debug_print("Creating ParsedDARReport from JSON data")
-                parsed_report = ParsedDARReport(**json_data)
+                debug_print("Parsing and validating ParsedDARReport from JSON")
+                parsed_report = ParsedDARReport.model_validate_json(response_text)
                 debug_print("ParsedDARReport created successfully")
                 
                 # Log some details about the parsed report
-                debug_print(f"Header present: {parsed_report.header is not None}")
-                debug_print(f"Number of audit paras: {len(parsed_report.audit_paras)}")
-                if parsed_report.header:
+                if _logger.isEnabledFor(logging.DEBUG):
+                    debug_print(f"Header present: {parsed_report.header is not None}")
+                    debug_print(f"Number of audit paras: {len(parsed_report.audit_paras)}")
+                if parsed_report.header and _logger.isEnabledFor(logging.DEBUG):
                     debug_print(f"Trade name: {parsed_report.header.trade_name}")
                     debug_print(f"GSTIN: {parsed_report.header.gstin}")
                 
-                return parsed_report
+                return parsed_report, 0.0
                 
-            except Exception as pydantic_e:
-                error_message = f"Data validation error (Attempt {attempt}): {str(pydantic_e)[:200]}..."
-                debug_exception(pydantic_e, f"Pydantic validation failed on attempt {attempt}")
-                debug_print(f"JSON data that failed validation: {json_data}")
+            except ValidationError as pydantic_e:
+                errors = pydantic_e.errors()
                 last_exception = pydantic_e
-                if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
-                wait_time = 5 + (attempt * 2)
-                debug_print(f"Waiting {wait_time} seconds before retry")
-                time.sleep(wait_time)
+
+                # Broken JSON (e.g. cut off at the token limit) is transient - back off and retry
+                if any(err["type"] == "json_invalid" for err in errors):
+                    error_message = f"Invalid JSON from Gemini (Attempt {attempt}): {errors[0]['msg'][:200]}..."
+                    debug_print(f"ERROR: {error_message}")
+                    debug_print(f"Problematic JSON text: {response_text[:500]}...")
+                    use_full_prompt = True
+                    if attempt > max_retries:
+                        return ParsedDARReport(parsing_errors=error_message), 0.0
+                    wait_time = _retry_wait_seconds(attempt)
+                    debug_print(f"Waiting {wait_time:.1f} seconds before retry")
+                    await asyncio.sleep(wait_time)
+                    continue
+
+                error_summary = "; ".join(
+                    f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in errors[:5]
+                )
+                error_message = f"Data validation error (Attempt {attempt}): {error_summary[:200]}..."
+                debug_exception(pydantic_e, f"Pydantic validation failed on attempt {attempt}")
+                if _logger.isEnabledFor(logging.DEBUG):  # Formatting the whole payload is costly - only when tracing
+                    debug_print(f"JSON data that failed validation: {response_text}")
+                # Wrong schema is not transient - one immediate retry with the full prompt, then fail fast
+                if use_full_prompt or attempt > max_retries:
+                    return ParsedDARReport(parsing_errors=error_message), NEGATIVE_CACHE_TTL_SECONDS
+                use_full_prompt = True
+                debug_print("Retrying immediately with the full prompt")
                 continue
                 
         except Exception as e:
-            error_message = f"API Error (Attempt {attempt}): {type(e).__name__} - {str(e)[:200]}..."
+            error_text = str(e)
+            error_lower = error_text.lower()  # Lowered once for all the classification checks below
+            error_message = f"API Error (Attempt {attempt}): {type(e).__name__} - {error_text[:200]}..."
             debug_exception(e, f"General API error on attempt {attempt}")
             
+            from google.api_core import exceptions as google_exceptions
+
+            # Timed-out request: plain retry with a short wait, not the quota backoff
+            if isinstance(e, google_exceptions.DeadlineExceeded):
+                error_message = f"Gemini request timed out after {GEMINI_TIMEOUT_SECONDS}s (Attempt {attempt})."
+                debug_print(f"TIMEOUT ERROR: {error_message}")
+                last_exception = e
+                if attempt > max_retries:
+                    return ParsedDARReport(parsing_errors=error_message), 0.0
+                wait_time = _retry_wait_seconds(attempt)
+                debug_print(f"Waiting {wait_time:.1f} seconds before retry")
+                await asyncio.sleep(wait_time)
+                continue
+
             # Handle specific free tier errors
-            if "quota" in str(e).lower() or "rate" in str(e).lower():
+            if _is_quota_error(e):
                 error_message = f"Free tier quota/rate limit exceeded (Attempt {attempt}). Please wait and try again."
                 debug_print(f"QUOTA ERROR: {error_message}")
                 last_exception = e
+                # Shared backoff - the wait itself happens before the next request
+                wait_time = _push_back_quota_window(attempt, e)
                 if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
-                # Longer wait for quota issues
-                wait_time = 30
-                debug_print(f"Waiting {wait_time} seconds for quota reset")
-                time.sleep(wait_time)
+                    # Remembered only until the quota window reopens
+                    return ParsedDARReport(parsing_errors=error_message), wait_time
+                debug_print(f"Quota window pushed back {wait_time:.1f} seconds")
                 continue
                 
-            elif "billing" in str(e).lower():
+            elif "billing" in error_lower:
                 error_message = "Billing issue detected. For free tier, ensure you have a valid Google account and the API key is generated correctly."
                 debug_print(f"BILLING ERROR: {error_message}")
-                return ParsedDARReport(parsing_errors=error_message)
+                return ParsedDARReport(parsing_errors=error_message), NEGATIVE_CACHE_TTL_SECONDS
                 
-            elif "API_KEY" in str(e).upper() or "auth" in str(e).lower():
+            elif "api_key" in error_lower or "auth" in error_lower:
                 error_message = "Authentication error. Please check your API key is valid and generated from Google AI Studio."
                 debug_print(f"AUTH ERROR: {error_message}")
-                return ParsedDARReport(parsing_errors=error_message)
+                return ParsedDARReport(parsing_errors=error_message), NEGATIVE_CACHE_TTL_SECONDS
                 
-            elif "RESOURCE_EXHAUSTED" in str(e).upper():
-                error_message = f"Resource exhausted (Attempt {attempt}). Free tier limits reached. Please wait and try again."
-                debug_print(f"RESOURCE ERROR: {error_message}")
-                last_exception = e
-                if attempt > max_retries:
-                    return ParsedDARReport(parsing_errors=error_message)
-                wait_time = 60  # Longer wait for resource exhaustion
-                debug_print(f"Waiting {wait_time} seconds for resource reset")
-                time.sleep(wait_time)
-                continue
             
             last_exception = e
-            if attempt > max_retries:
-                return ParsedDARReport(parsing_errors=error_message)
-            wait_time = 5 + (attempt * 2)
-            debug_print(f"Waiting {wait_time} seconds before retry")
-            time.sleep(wait_time)
+            if attempt > max_retries or not _is_retryable(e):
+                debug_print(f"Not retrying {type(e).__name__}")
+                # A rejected request (4xx) fails the same way again; 5xx/connection errors may not
+                error_code = getattr(e, "code", None)
+                is_client_error = isinstance(error_code, int) and 400 <= error_code < 500 and not _is_retryable(e)
+                return ParsedDARReport(parsing_errors=error_message), NEGATIVE_CACHE_TTL_SECONDS if is_client_error else 0.0
+            wait_time = _retry_wait_seconds(attempt)
+            debug_print(f"Waiting {wait_time:.1f} seconds before retry")
+            await asyncio.sleep(wait_time)
     
     # If we get here, all attempts failed
     final_error = f"Gemini API failed after {max_retries + 1} attempts. Last error: {str(last_exception)[:200]}... Try again in a few minutes (free tier rate limits)."
     debug_print(f"FINAL ERROR: {final_error}")
-    return ParsedDARReport(parsing_errors=final_error)
+    return ParsedDARReport(parsing_errors=final_error), 0.0
 # import streamlit as st
 # import json
 # import time
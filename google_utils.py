@@ -3,7 +3,6 @@ import streamlit as st
 import os
 import json
 from io import BytesIO
-import pandas as pd
 import math
 
 from google.oauth2 import service_account
@@ -177,6 +176,9 @@ def save_mcm_periods(sheets_service, periods_data):
         st.error(f"Unexpected error saving MCM periods: {e}")
         return False
 
+# Drive accepts single-request (multipart) uploads up to 5 MB; larger files need the resumable protocol
+DRIVE_SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+
 def upload_to_drive(drive_service, file_content_or_path, filename_on_drive):
     """Upload to centralized DAR folder"""
     try:
@@ -189,11 +191,14 @@ def upload_to_drive(drive_service, file_content_or_path, filename_on_drive):
         if isinstance(file_content_or_path, str) and os.path.exists(file_content_or_path):
             media_body = MediaFileUpload(file_content_or_path, mimetype='application/pdf', resumable=True)
         elif isinstance(file_content_or_path, bytes):
+            # BytesIO over bytes shares the buffer (no copy); small files go in one multipart request
             fh = BytesIO(file_content_or_path)
-            media_body = MediaIoBaseUpload(fh, mimetype='application/pdf', resumable=True)
+            media_body = MediaIoBaseUpload(fh, mimetype='application/pdf',
+                                           resumable=len(file_content_or_path) > DRIVE_SIMPLE_UPLOAD_MAX_BYTES)
         elif isinstance(file_content_or_path, BytesIO):
             file_content_or_path.seek(0)
-            media_body = MediaIoBaseUpload(file_content_or_path, mimetype='application/pdf', resumable=True)
+            media_body = MediaIoBaseUpload(file_content_or_path, mimetype='application/pdf',
+                                           resumable=file_content_or_path.getbuffer().nbytes > DRIVE_SIMPLE_UPLOAD_MAX_BYTES)
         else:
             st.error(f"Unsupported file content type for Google Drive upload: {type(file_content_or_path)}")
             return None, None
@@ -229,21 +234,37 @@ def set_public_read_permission(drive_service, file_id):
     except Exception as e:
         st.warning(f"Unexpected error setting public permission for file ID {file_id}: {e}")
 
+# Per-process metadata for the master database: the first tab's title and whether its header row
+# has been seen, so an append is one values.append call instead of three round-trips
+_first_sheet_titles = {}
+_master_header_confirmed = False
+
+def _get_first_sheet_title(sheets_service, spreadsheet_id):
+    """Title of the spreadsheet's first tab, fetched once (titles only) and reused"""
+    if spreadsheet_id not in _first_sheet_titles:
+        sheet_metadata = sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields='sheets.properties.title'
+        ).execute()
+        sheets = sheet_metadata.get('sheets', '')
+        _first_sheet_titles[spreadsheet_id] = sheets[0].get("properties", {}).get("title", "Sheet1")
+    return _first_sheet_titles[spreadsheet_id]
+
 def append_to_spreadsheet(sheets_service, values_to_append):
     """Append to centralized master database"""
+    global _master_header_confirmed
     try:
         body = {'values': values_to_append}
-        sheet_metadata = sheets_service.spreadsheets().get(spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID).execute()
-        sheets = sheet_metadata.get('sheets', '')
-        first_sheet_title = sheets[0].get("properties", {}).get("title", "Sheet1")
+        first_sheet_title = _get_first_sheet_title(sheets_service, MASTER_DAR_DATABASE_SHEET_ID)
 
-        # Check if header exists
-        range_to_check_header = f"{first_sheet_title}!A1:O1"  # Updated to O for MCM Period column
-        result_header_check = sheets_service.spreadsheets().values().get(
-            spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID,
-            range=range_to_check_header
-        ).execute()
-        header_row_in_sheet = result_header_check.get('values', [])
+        # Check if header exists (once per process - rows are only ever appended below it)
+        header_row_in_sheet = _master_header_confirmed
+        if not header_row_in_sheet:
+            range_to_check_header = f"{first_sheet_title}!A1:O1"  # Updated to O for MCM Period column
+            result_header_check = sheets_service.spreadsheets().values().get(
+                spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID,
+                range=range_to_check_header
+            ).execute()
+            header_row_in_sheet = result_header_check.get('values', [])
 
         if not header_row_in_sheet:  # No header at all, create it
             header_to_write = [[
@@ -265,8 +286,12 @@ def append_to_spreadsheet(sheets_service, values_to_append):
             spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID,
             range=f"{first_sheet_title}!A1",
             valueInputOption='USER_ENTERED',
+            insertDataOption='INSERT_ROWS',  # New rows are inserted, never written over cells below the table
+            fields='updates(updatedRange,updatedRows)',  # Skip echoing the table range back
             body=body
         ).execute()
+        _master_header_confirmed = True
+        _read_from_spreadsheet_cached.clear()
         return append_result
         
     except HttpError as error:
@@ -276,8 +301,23 @@ def append_to_spreadsheet(sheets_service, values_to_append):
         st.error(f"Unexpected error appending to Spreadsheet: {e}")
         return None
 
+MASTER_DB_CACHE_TTL_SECONDS = 60
+
+@st.cache_data(ttl=MASTER_DB_CACHE_TTL_SECONDS, show_spinner=False)
+def _read_from_spreadsheet_cached(_sheets_service, sheet_name):
+    return read_from_spreadsheet(_sheets_service, sheet_name)
+
+def read_from_spreadsheet_cached(sheets_service, sheet_name="Sheet1"):
+    """read_from_spreadsheet for display paths: reruns within MASTER_DB_CACHE_TTL_SECONDS reuse the
+    last read (as a copy); failed reads are not kept, and every write below clears the cache"""
+    df = _read_from_spreadsheet_cached(sheets_service, sheet_name)
+    if df is None:
+        _read_from_spreadsheet_cached.clear()
+    return df
+
 def read_from_spreadsheet(sheets_service, sheet_name="Sheet1"):
     """Read from centralized master database"""
+    import pandas as pd  # Lazy - app.py imports this module on the login path
     try:
         result = sheets_service.spreadsheets().values().get(
             spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID,
@@ -382,6 +422,7 @@ def delete_spreadsheet_rows(sheets_service, sheet_id_gid, row_indices_to_delete)
             body = {'requests': requests}
             sheets_service.spreadsheets().batchUpdate(
                 spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID, body=body).execute()
+            _read_from_spreadsheet_cached.clear()
             return True
         except HttpError as error:
             st.error(f"An error occurred deleting rows from Spreadsheet: {error}")
@@ -394,8 +435,7 @@ def delete_spreadsheet_rows(sheets_service, sheet_id_gid, row_indices_to_delete)
 def update_spreadsheet_from_df(sheets_service, df_to_write):
     """Update centralized master database from DataFrame"""
     try:
-        sheet_metadata = sheets_service.spreadsheets().get(spreadsheetId=MASTER_DAR_DATABASE_SHEET_ID).execute()
-        first_sheet_title = sheet_metadata['sheets'][0]['properties']['title']
+        first_sheet_title = _get_first_sheet_title(sheets_service, MASTER_DAR_DATABASE_SHEET_ID)
 
         clear_range = f"{first_sheet_title}"
         sheets_service.spreadsheets().values().clear(
@@ -414,6 +454,7 @@ def update_spreadsheet_from_df(sheets_service, df_to_write):
             valueInputOption='USER_ENTERED',
             body=body
         ).execute()
+        _read_from_spreadsheet_cached.clear()
         
         return True
 
@@ -1,40 +1,45 @@
  # ui_audit_group.py - Clean version with proper indentation
 import streamlit as st
 import pandas as pd
-import datetime
+import numpy as np
 import math
-from io import BytesIO
 import time
-import traceback
+import logging
+import os
 import sys
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from google_utils import (
     load_mcm_periods, upload_to_drive, append_to_spreadsheet,
     read_from_spreadsheet, delete_spreadsheet_rows
 )
-from dar_processor import preprocess_pdf_text
-from gemini_utils import get_structured_data_with_gemini
 from validation_utils import validate_data_for_sheet, VALID_CATEGORIES, VALID_PARA_STATUSES
 from config import USER_CREDENTIALS, AUDIT_GROUP_NUMBERS, MASTER_DAR_DATABASE_SHEET_ID
-from models import ParsedDARReport
 
 from streamlit_option_menu import option_menu
 
+# Debug output goes through logging: AG_DEBUG=INFO (or DEBUG) shows the per-step trace,
+# the default (WARNING) keeps only errors, so reruns skip the formatting and stdout flushes
+_logger = logging.getLogger(__name__)
+if not _logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    _logger.addHandler(_handler)
+    _logger.propagate = False
+_level = logging.getLevelName(os.environ.get("AG_DEBUG", "WARNING").upper())
+_logger.setLevel(_level if isinstance(_level, int) else logging.WARNING)  # Unknown names map to "Level x" - ignore them
+DEBUG = _logger.isEnabledFor(logging.INFO)  # Fixed at import - guards f-string traces on rerun paths so they are never built
+
 def debug_print(message, level="INFO"):
-    """Print debug messages with timestamp"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [{level}] {message}")
-    sys.stdout.flush()
+    """Log a debug trace message (dropped unless AG_DEBUG enables the level)"""
+    _logger.log(logging.getLevelName(level), message)
 
 def debug_exception(e, context=""):
-    """Print detailed exception information"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] [ERROR] {context}")
-    print(f"Exception type: {type(e).__name__}")
-    print(f"Exception message: {str(e)}")
-    print("Traceback:")
-    traceback.print_exc()
-    sys.stdout.flush()
+    """Log detailed exception information with traceback"""
+    _logger.error(f"{context}\nException type: {type(e).__name__}\nException message: {str(e)}", exc_info=e)
 
 SHEET_DATA_COLUMNS_ORDER = [
     "audit_group_number", "audit_circle_number", "gstin", "trade_name", "category",
@@ -49,6 +54,10 @@ DISPLAY_COLUMN_ORDER_EDITOR = [
     "audit_para_number", "audit_para_heading",
     "revenue_involved_lakhs_rs", "revenue_recovered_lakhs_rs", "status_of_para"
 ]
+_EMPTY_ROW_TEMPLATE = dict.fromkeys(DISPLAY_COLUMN_ORDER_EDITOR)  # Copied with dict() for each new editor row
+# Partial reruns (Streamlit >= 1.33; older releases only have the experimental name, or neither)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+_EMPTY_EDITOR_DF = pd.DataFrame(columns=DISPLAY_COLUMN_ORDER_EDITOR).astype(object)  # Shallow-copied on every reset
 
 def get_cached_mcm_periods_ag(sheets_service, ttl_seconds=120):
     cache_key_data = 'ag_ui_cached_mcm_periods_data'
@@ -63,6 +72,20 @@ def get_cached_mcm_periods_ag(sheets_service, ttl_seconds=120):
     st.session_state[cache_key_ts] = current_time
     return periods
 
+def get_cached_period_options_ag(mcm_periods_all):
+    """Active periods and their selectbox labels (newest first), rebuilt only when a new periods
+    dict is loaded - between loads the same object comes back from the session cache"""
+    cache_key_src = 'ag_ui_period_options_source'
+    cache_key_data = 'ag_ui_period_options_data'
+    if st.session_state.get(cache_key_src) is mcm_periods_all and cache_key_data in st.session_state:
+        return st.session_state[cache_key_data]
+    active_periods = {k: v for k, v in mcm_periods_all.items() if v.get("active")}
+    period_options = {k: f"{v.get('month_name')} {v.get('year')}" for k, v in sorted(active_periods.items(), reverse=True)}
+    st.session_state[cache_key_src] = mcm_periods_all
+    st.session_state[cache_key_data] = (active_periods, period_options)
+    return active_periods, period_options
+
+@functools.lru_cache(maxsize=64)  # Domain is groups 1-30; every row build asks for the same group
 def calculate_audit_circle(audit_group_number_val):
     try:
         agn = int(audit_group_number_val)
@@ -72,7 +95,28 @@ def calculate_audit_circle(audit_group_number_val):
     except (ValueError, TypeError, AttributeError):
         return None
 
-def test_gemini_api():
+GEMINI_PROBE_CACHE_SECONDS = 300
+_gemini_probe_successes = {}  # sha256(api key)[:16] -> (monotonic time, response text) of the last successful probe
+
+def _probe_gemini(api_key: str, force: bool = False) -> str:
+    """One real test request per API key every GEMINI_PROBE_CACHE_SECONDS - repeated clicks don't burn
+    free-tier quota. Only successful probes are remembered, so a failure is re-tested on the next click;
+    force skips the lookup for this key without dropping anything other sessions rely on."""
+    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    last_success = _gemini_probe_successes.get(api_key_hash)
+    if not force and last_success and time.monotonic() - last_success[0] < GEMINI_PROBE_CACHE_SECONDS:
+        return last_success[1]
+    debug_print("Sending Gemini API test request")
+    from gemini_utils import _get_gemini_model, _gemini_with_retry  # Lazy - only when the probe actually runs
+    model = _get_gemini_model(api_key)  # Same cached model the extraction uses
+    test_prompt = "Please respond with exactly: 'API_TEST_SUCCESS'"
+    response = _gemini_with_retry(model.generate_content, test_prompt)  # Shares the extraction limiters
+    response_text = response.text if response else ""
+    if "API_TEST_SUCCESS" in response_text:
+        _gemini_probe_successes[api_key_hash] = (time.monotonic(), response_text)
+    return response_text
+
+def test_gemini_api(force: bool = False):
     """Test function to verify Gemini API is working"""
     st.markdown("### 🔍 Test Gemini API Connection")
     
@@ -86,16 +130,10 @@ def test_gemini_api():
         return False
     
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        test_prompt = "Please respond with exactly: 'API_TEST_SUCCESS'"
-        
         with st.spinner("Testing Gemini API connection..."):
-            response = model.generate_content(test_prompt)
+            response_text = _probe_gemini(api_key, force=force)
         
-        if response and response.text and "API_TEST_SUCCESS" in response.text:
+        if response_text and "API_TEST_SUCCESS" in response_text:
             st.success("✅ Gemini API is working correctly!")
             return True
         else:
@@ -106,51 +144,110 @@ def test_gemini_api():
         st.error(f"❌ Gemini API Error: {str(e)}")
         return False
 
+DRIVE_UPLOAD_CACHE_MAX_ENTRIES = 32  # (content hash, Drive name, MCM period) -> (drive_id, url) uploaded this session
+
+class _UncacheableText(Exception):
+    """Carries error/partial PDF text out of the cached extraction so it is not stored"""
+    def __init__(self, text: str):
+        super().__init__(text[:200])
+        self.text = text
+
+@st.cache_data(ttl="1h", max_entries=64, show_spinner=False)
+def _extract_pdf_text_cached(pdf_md5: str, _pdf_bytes: bytes) -> str:
+    """PDF text keyed by content hash - re-clicks and reruns on the same file skip the parse.
+    _pdf_bytes is excluded from Streamlit's argument hashing; pdf_md5 is the cache key."""
+    from dar_processor import preprocess_pdf_text, PARTIAL_EXTRACTION_NOTE  # Lazy - PDF libs load on first extraction
+    text = preprocess_pdf_text(_pdf_bytes)
+    if text.startswith("Error") or PARTIAL_EXTRACTION_NOTE in text:
+        raise _UncacheableText(text)  # A slow or failed read must not be served again on Re-extract
+    return text
+
+def _extract_pdf_text(pdf_md5: str, pdf_bytes: bytes) -> str:
+    try:
+        return _extract_pdf_text_cached(pdf_md5, pdf_bytes)
+    except _UncacheableText as partial:
+        return partial.text
+
 def process_pdf_extraction_simple(drive_service=None):
     """Simple PDF extraction function with Drive upload bypass"""
     debug_print("=== STARTING PDF EXTRACTION ===")
+    ss = st.session_state  # One proxy lookup; values read once below
+    file_obj = ss.ag_current_uploaded_file_obj
     
     try:
         # Get PDF bytes
-        if hasattr(st.session_state.ag_current_uploaded_file_obj, 'getvalue'):
-            pdf_bytes = st.session_state.ag_current_uploaded_file_obj.getvalue()
+        if hasattr(file_obj, 'getvalue'):
+            pdf_bytes = file_obj.getvalue()
             debug_print(f"Got PDF bytes: {len(pdf_bytes)} bytes")
         else:
             st.error("Cannot read PDF file")
             return
         
-        # Try Drive upload (with fallback)
-        dar_filename = f"AG{st.session_state.audit_group_no}_{st.session_state.ag_current_uploaded_file_name}"
+        # Header check before any upload/parse: '%PDF' must appear in the first 1 KB (searched in place, no slice)
+        if pdf_bytes.find(b'%PDF', 0, 1024) == -1:
+            if DEBUG:  # Only slice the bytes when the trace is on
+                debug_print(f"Not a PDF - first bytes: {pdf_bytes[:20]!r}")
+            st.error("❌ The uploaded file is not a valid PDF")
+            return
         
-        try:
-            if drive_service:
-                pdf_drive_id, pdf_drive_url = upload_to_drive(drive_service, BytesIO(pdf_bytes), dar_filename)
-                if pdf_drive_id:
-                    st.session_state.ag_pdf_drive_url = pdf_drive_url
-                    st.success(f"✅ PDF uploaded to Drive")
-                else:
-                    raise Exception("Drive upload returned None")
-            else:
-                raise Exception("No drive service")
-        except Exception as e_drive:
-            debug_print(f"Drive upload failed: {str(e_drive)}")
-            st.warning("⚠️ Drive upload failed. Continuing with PDF processing...")
-            st.session_state.ag_pdf_drive_url = f"#placeholder-{dar_filename}"
+        # Drive upload runs in a background thread while the text is extracted (neither needs the other);
+        # a PDF already uploaded in this session (same content, Drive name and period) reuses its Drive file
+        dar_filename = f"AG{ss.audit_group_no}_{ss.ag_current_uploaded_file_name}"
+        pdf_md5 = hashlib.md5(pdf_bytes).hexdigest()
+        upload_key = (pdf_md5, dar_filename, ss.ag_current_mcm_key)
+        upload_cache = ss.setdefault('ag_drive_upload_cache', {})
+        previous_upload = upload_cache.pop(upload_key, None)
+        upload_future = None
+        if previous_upload:
+            debug_print(f"PDF already uploaded this session - reusing Drive file {previous_upload[0]}")
+            upload_cache[upload_key] = previous_upload  # Re-insert as most recently used
+        elif drive_service:
+            # The worker gets this script run's context, so st.error/st.warning raised inside
+            # upload_to_drive (and its permission step) still reach the user
+            upload_executor = ThreadPoolExecutor(max_workers=1, initializer=add_script_run_ctx,
+                                                 initargs=(None, get_script_run_ctx()))
+            upload_future = upload_executor.submit(upload_to_drive, drive_service, pdf_bytes, dar_filename)
+            upload_executor.shutdown(wait=False)
         
         # Extract PDF text
         debug_print("Starting PDF text extraction")
         st.info("🔍 Extracting text from PDF...")
         
         try:
-            preprocessed_text = preprocess_pdf_text(BytesIO(pdf_bytes))
+            preprocessed_text = _extract_pdf_text(pdf_md5, pdf_bytes)
             debug_print(f"Text extracted: {len(preprocessed_text)} characters")
             
+            # Collect the Drive upload (with fallback) - UI updates stay on the script thread
+            try:
+                if previous_upload:
+                    ss.ag_pdf_drive_url = previous_upload[1]
+                    st.success(f"✅ PDF already on Drive")
+                elif upload_future is not None:
+                    pdf_drive_id, pdf_drive_url = upload_future.result()
+                    if pdf_drive_id:
+                        upload_cache[upload_key] = (pdf_drive_id, pdf_drive_url)
+                        while len(upload_cache) > DRIVE_UPLOAD_CACHE_MAX_ENTRIES:
+                            upload_cache.pop(next(iter(upload_cache)))  # Evict least recently used
+                        ss.ag_pdf_drive_url = pdf_drive_url
+                        st.success(f"✅ PDF uploaded to Drive")
+                    else:
+                        raise Exception("Drive upload returned None")
+                else:
+                    raise Exception("No drive service")
+            except Exception as e_drive:
+                debug_print(f"Drive upload failed: {str(e_drive)}")
+                st.warning("⚠️ Drive upload failed. Continuing with PDF processing...")
+                ss.ag_pdf_drive_url = f"#placeholder-{dar_filename}"
+            
             if preprocessed_text.startswith("Error"):
                 st.error(f"❌ PDF extraction failed: {preprocessed_text}")
                 create_fallback_row("PDF Processing Error")
                 return
             
             st.success(f"✅ Text extracted: {len(preprocessed_text)} characters")
+            from dar_processor import PARTIAL_EXTRACTION_NOTE  # Already loaded by the extraction above
+            if PARTIAL_EXTRACTION_NOTE in preprocessed_text:
+                st.warning("⚠️ Only part of the PDF could be read - the extracted pages are used, please check the remaining paras manually")
             
             # Show preview
             with st.expander("📖 Preview (first 500 characters)"):
@@ -165,8 +262,9 @@ def process_pdf_extraction_simple(drive_service=None):
                 if not api_key:
                     raise ValueError("No API key")
                 
+                from gemini_utils import get_structured_data_chunked  # Lazy, like the probe
                 with st.spinner("🤖 AI analyzing document..."):
-                    parsed_data = get_structured_data_with_gemini(api_key, preprocessed_text)
+                    parsed_data = get_structured_data_chunked(api_key, preprocessed_text)
                 
                 debug_print(f"Gemini completed. Errors: {parsed_data.parsing_errors}")
                 
@@ -203,7 +301,8 @@ def process_gemini_results(parsed_data):
     
     # Get header info
     header_dict = parsed_data.header.model_dump() if parsed_data.header else {}
-    debug_print(f"Header: {header_dict}")
+    if DEBUG:
+        debug_print(f"Header: {header_dict}")
     
     if header_dict:
         st.success("✅ Header information extracted:")
@@ -214,8 +313,9 @@ def process_gemini_results(parsed_data):
         with col2:
             st.write(f"**Category:** {header_dict.get('category', 'Not found')}")
     
-    # Base info for all rows
-    base_info = {
+    # Base info for all rows (starts from the all-None template so every editor column is present)
+    base_info = dict(_EMPTY_ROW_TEMPLATE)
+    base_info.update({
         "audit_group_number": st.session_state.audit_group_no,
         "audit_circle_number": calculate_audit_circle(st.session_state.audit_group_no),
         "gstin": header_dict.get("gstin"),
@@ -223,7 +323,7 @@ def process_gemini_results(parsed_data):
         "category": header_dict.get("category"),
         "total_amount_detected_overall_rs": header_dict.get("total_amount_detected_overall_rs"),
         "total_amount_recovered_overall_rs": header_dict.get("total_amount_recovered_overall_rs"),
-    }
+    })
     
     # Process audit paras
     if parsed_data.audit_paras:
@@ -267,15 +367,9 @@ def process_gemini_results(parsed_data):
     # Create DataFrame
     if temp_list_for_df:
         debug_print(f"Creating DataFrame with {len(temp_list_for_df)} rows")
-        df_extracted = pd.DataFrame(temp_list_for_df)
-        
-        # Ensure all columns exist
-        for col in DISPLAY_COLUMN_ORDER_EDITOR:
-            if col not in df_extracted.columns:
-                df_extracted[col] = None
-        
-        st.session_state.ag_editor_data = df_extracted[DISPLAY_COLUMN_ORDER_EDITOR]
-        debug_print(f"DataFrame stored: {st.session_state.ag_editor_data.shape}")
+        # Rows all start from _EMPTY_ROW_TEMPLATE, so one from_records call gives every column in editor order
+        st.session_state.ag_editor_data = pd.DataFrame.from_records(temp_list_for_df, columns=DISPLAY_COLUMN_ORDER_EDITOR)
+        st.session_state.ag_editor_has_data = True
         
         st.success("✅ Data extraction completed!")
         st.rerun()
@@ -284,50 +378,184 @@ def create_fallback_row(reason):
     """Create a fallback row when extraction fails"""
     debug_print(f"Creating fallback row: {reason}")
     
-    fallback_row = {col: None for col in DISPLAY_COLUMN_ORDER_EDITOR}
+    fallback_row = dict(_EMPTY_ROW_TEMPLATE)
     fallback_row.update({
         "audit_group_number": st.session_state.audit_group_no,
         "audit_circle_number": calculate_audit_circle(st.session_state.audit_group_no),
         "audit_para_heading": f"Manual Entry Required - {reason}"
     })
     
-    df_fallback = pd.DataFrame([fallback_row])
-    st.session_state.ag_editor_data = df_fallback[DISPLAY_COLUMN_ORDER_EDITOR]
+    st.session_state.ag_editor_data = pd.DataFrame.from_records([fallback_row], columns=DISPLAY_COLUMN_ORDER_EDITOR)
+    st.session_state.ag_editor_has_data = True
     
     st.success("✅ Fallback entry created. Please edit manually.")
     st.rerun()
 
+@functools.lru_cache(maxsize=1)  # Built on first render, then shared by every rerun of the editor
+def _editor_col_config():
+    col_config = {
+        "audit_group_number": st.column_config.NumberColumn(disabled=True),
+        "audit_circle_number": st.column_config.NumberColumn(disabled=True),
+        "gstin": st.column_config.TextColumn(width="medium"),
+        "trade_name": st.column_config.TextColumn(width="large"),
+        "category": st.column_config.SelectboxColumn(options=[None] + VALID_CATEGORIES, width="small"),
+        "audit_para_heading": st.column_config.TextColumn("Para Heading", width="xlarge"),
+        "status_of_para": st.column_config.SelectboxColumn("Status", options=[None] + VALID_PARA_STATUSES, width="medium")
+    }
+    return {k: v for k, v in col_config.items() if k in DISPLAY_COLUMN_ORDER_EDITOR}
+
+@_fragment
+def _upload_tab(active_periods, period_options, drive_service):
+    """Upload tab as a fragment - period/file/editor interactions rerun only this block,
+    not the sidebar, option menu and MCM period load of audit_group_dashboard"""
+    ss = st.session_state
+    debug_print("Upload DAR tab selected")
+    st.markdown("<h3>Upload DAR PDF for MCM Period</h3>", unsafe_allow_html=True)
+    
+    if not active_periods:
+        st.warning("No active MCM periods available")
+        return
+    
+    # Period selection
+    period_keys = list(period_options.keys())
+    
+    if period_keys:
+        selected_period = st.selectbox(
+            "Select MCM Period",
+            options=period_keys,
+            format_func=lambda k: period_options[k],
+            key=f"period_select_{ss.ag_uploader_key_suffix}"
+        )
+        
+        if selected_period != ss.ag_current_mcm_key:
+            debug_print("Period changed, resetting state")
+            ss.ag_current_mcm_key = selected_period
+            ss.ag_current_uploaded_file_obj = None
+            ss.ag_current_uploaded_file_name = None
+            ss.ag_editor_data = _EMPTY_EDITOR_DF.copy(deep=False)
+            ss.ag_editor_has_data = False
+            ss.ag_uploader_key_suffix += 1
+            st.rerun()
+        
+        st.info(f"Uploading for: {period_options[selected_period]}")
+        
+        # File upload
+        uploaded_file = st.file_uploader(
+            "Choose DAR PDF",
+            type="pdf",
+            key=f"uploader_{selected_period}_{ss.ag_uploader_key_suffix}"
+        )
+        
+        if uploaded_file:
+            if DEBUG:
+                debug_print(f"File uploaded: {uploaded_file.name}")
+            
+            if (ss.ag_current_uploaded_file_name != uploaded_file.name or 
+                ss.ag_current_uploaded_file_obj is None):
+                debug_print("New file detected")
+                ss.ag_current_uploaded_file_obj = uploaded_file
+                ss.ag_current_uploaded_file_name = uploaded_file.name
+                ss.ag_editor_data = _EMPTY_EDITOR_DF.copy(deep=False)
+                ss.ag_editor_has_data = False
+            
+            # Extract button
+            extract_key = f"extract_{selected_period}_{uploaded_file.name}"
+            
+            if not ss.ag_editor_has_data:
+                if st.button("Extract Data from PDF", key=extract_key, use_container_width=True):
+                    debug_print("Extract button clicked")
+                    process_pdf_extraction_simple(drive_service)
+            else:
+                st.success("✅ Data extracted. Review below.")
+                if st.button("Re-extract Data", key=f"re_{extract_key}", use_container_width=True):
+                    debug_print("Re-extract clicked")
+                    process_pdf_extraction_simple(drive_service)
+    
+    # Data editor
+    if ss.ag_editor_has_data:
+        st.markdown("<h4>Review and Edit Data:</h4>", unsafe_allow_html=True)
+        
+        # Editor and submit widgets share one period/file suffix, built once per render
+        widget_key_suffix = f"{ss.ag_current_mcm_key}_{ss.ag_current_uploaded_file_name}"
+        editor_key = "editor_" + widget_key_suffix
+        
+        edited_df = pd.DataFrame(st.data_editor(
+            ss.ag_editor_data,  # No defensive copy - the editor returns its edits as a new frame and never mutates this one
+            column_config=_editor_col_config(),
+            num_rows="dynamic",
+            key=editor_key,
+            use_container_width=True,
+            hide_index=True
+        ))
+        
+        # Submit button
+        submit_key = "submit_" + widget_key_suffix
+        
+        if st.button("Submit to Database", key=submit_key, use_container_width=True):
+            debug_print("Submit clicked")
+            
+            if edited_df.empty:
+                st.error("No data to submit")
+            else:
+                # Simple validation
+                required_cols = ['gstin', 'trade_name', 'audit_para_heading']
+                # One isna pass serves both the empty-row drop and the required-field check
+                is_missing = edited_df.isna().to_numpy()
+                keep_rows = ~is_missing.all(axis=1)
+                df_clean = edited_df[keep_rows].reset_index(drop=True)
+                required_idx = edited_df.columns.get_indexer(required_cols)
+                assert (required_idx >= 0).all(), f"Editor is missing required columns: {required_cols}"
+                # Row numbers come from the unfiltered array, so they match the rows shown in the editor
+                missing_rows = np.flatnonzero(keep_rows & is_missing[:, required_idx].any(axis=1)) + 1
+                
+                if df_clean.empty:
+                    st.error("Only empty rows found")
+                elif missing_rows.size:
+                    st.error(f"Missing required information in row(s): {', '.join(map(str, missing_rows.tolist()))}")
+                else:
+                    # Would submit to database here
+                    st.success("✅ Data would be submitted to database!")
+                    st.balloons()
+
+# Session state owned by this dashboard (cleared on logout); callables are factories for mutable defaults,
+# as in app.py, so the dict is built once per process instead of on every rerun
+_AG_SESSION_DEFAULTS = {
+    'ag_current_mcm_key': None,
+    'ag_current_uploaded_file_obj': None,
+    'ag_current_uploaded_file_name': None,
+    'ag_editor_data': None,  # Filled in audit_group_dashboard - pandas frame built only when missing
+    'ag_editor_has_data': False,  # True once extracted/fallback rows are in ag_editor_data
+    'ag_pdf_drive_url': None,
+    'ag_validation_errors': list,
+    'ag_uploader_key_suffix': 0,
+    'ag_deletable_map': dict,
+}
+
 def audit_group_dashboard(drive_service, sheets_service):
-    st.markdown(f"<div class='sub-header'>Audit Group {st.session_state.audit_group_no} Dashboard</div>", unsafe_allow_html=True)
+    ss = st.session_state  # Local alias - the dashboard reads session state on every rerun
+    st.markdown(f"<div class='sub-header'>Audit Group {ss.audit_group_no} Dashboard</div>", unsafe_allow_html=True)
     
-    debug_print(f"Starting dashboard for group {st.session_state.audit_group_no}")
+    if DEBUG:
+        debug_print(f"Starting dashboard for group {ss.audit_group_no}")
     
     st.info("📁 All DARs are uploaded to the centralized folder and stored in the Master DAR Database.")
     
     try:
         mcm_periods_all = get_cached_mcm_periods_ag(sheets_service)
-        active_periods = {k: v for k, v in mcm_periods_all.items() if v.get("active")}
-        debug_print(f"Active periods: {len(active_periods)}")
+        active_periods, period_options = get_cached_period_options_ag(mcm_periods_all)
+        if DEBUG:
+            debug_print(f"Active periods: {len(active_periods)}")
     except Exception as e:
         debug_exception(e, "Error loading MCM periods")
         st.error("Error loading MCM periods")
         return
     
     # Initialize session state
-    default_states = {
-        'ag_current_mcm_key': None,
-        'ag_current_uploaded_file_obj': None,
-        'ag_current_uploaded_file_name': None,
-        'ag_editor_data': pd.DataFrame(columns=DISPLAY_COLUMN_ORDER_EDITOR),
-        'ag_pdf_drive_url': None,
-        'ag_validation_errors': [],
-        'ag_uploader_key_suffix': 0,
-        'ag_deletable_map': {}
-    }
-    
-    for key, value in default_states.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
+    for key, value in _AG_SESSION_DEFAULTS.items():
+        if key not in ss:
+            ss[key] = value() if callable(value) else value
+    if ss.ag_editor_data is None:  # app.py leaves this unset to keep pandas off the login path
+        ss.ag_editor_data = _EMPTY_EDITOR_DF.copy(deep=False)
     
     # Sidebar
     with st.sidebar:
@@ -336,7 +564,7 @@ def audit_group_dashboard(drive_service, sheets_service):
         except:
             st.markdown("*(Logo)*")
         
-        st.markdown(f"**User:** {st.session_state.username}<br>**Group:** {st.session_state.audit_group_no}", unsafe_allow_html=True)
+        st.markdown(f"**User:** {ss.username}<br>**Group:** {ss.audit_group_no}", unsafe_allow_html=True)
         
         st.markdown("---")
         st.markdown("#### 🔧 Debug Tools")
@@ -344,14 +572,17 @@ def audit_group_dashboard(drive_service, sheets_service):
         if st.button("Test Gemini API"):
             test_gemini_api()
         
+        if st.button("Force re-test Gemini API"):
+            test_gemini_api(force=True)
+        
         if st.button("Logout", use_container_width=True):
-            for key in list(default_states.keys()):
-                if key in st.session_state:
-                    del st.session_state[key]
-            st.session_state.logged_in = False
-            st.session_state.username = ""
-            st.session_state.role = ""
-            st.session_state.audit_group_no = None
+            for key in _AG_SESSION_DEFAULTS:
+                if key in ss:
+                    del ss[key]
+            ss.logged_in = False
+            ss.username = ""
+            ss.role = ""
+            ss.audit_group_no = None
             st.rerun()
     
     # Main content
@@ -367,112 +598,7 @@ def audit_group_dashboard(drive_service, sheets_service):
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     
     if selected_tab == "Upload DAR for MCM":
-        debug_print("Upload DAR tab selected")
-        st.markdown("<h3>Upload DAR PDF for MCM Period</h3>", unsafe_allow_html=True)
-        
-        if not active_periods:
-            st.warning("No active MCM periods available")
-            return
-        
-        # Period selection
-        period_options = {k: f"{v.get('month_name')} {v.get('year')}" for k, v in sorted(active_periods.items(), reverse=True)}
-        period_keys = list(period_options.keys())
-        
-        if period_keys:
-            selected_period = st.selectbox(
-                "Select MCM Period",
-                options=period_keys,
-                format_func=lambda k: period_options[k],
-                key=f"period_select_{st.session_state.ag_uploader_key_suffix}"
-            )
-            
-            if selected_period != st.session_state.ag_current_mcm_key:
-                debug_print("Period changed, resetting state")
-                st.session_state.ag_current_mcm_key = selected_period
-                st.session_state.ag_current_uploaded_file_obj = None
-                st.session_state.ag_current_uploaded_file_name = None
-                st.session_state.ag_editor_data = pd.DataFrame(columns=DISPLAY_COLUMN_ORDER_EDITOR)
-                st.session_state.ag_uploader_key_suffix += 1
-                st.rerun()
-            
-            st.info(f"Uploading for: {period_options[selected_period]}")
-            
-            # File upload
-            uploaded_file = st.file_uploader(
-                "Choose DAR PDF",
-                type="pdf",
-                key=f"uploader_{selected_period}_{st.session_state.ag_uploader_key_suffix}"
-            )
-            
-            if uploaded_file:
-                debug_print(f"File uploaded: {uploaded_file.name}")
-                
-                if (st.session_state.ag_current_uploaded_file_name != uploaded_file.name or 
-                    st.session_state.ag_current_uploaded_file_obj is None):
-                    debug_print("New file detected")
-                    st.session_state.ag_current_uploaded_file_obj = uploaded_file
-                    st.session_state.ag_current_uploaded_file_name = uploaded_file.name
-                    st.session_state.ag_editor_data = pd.DataFrame(columns=DISPLAY_COLUMN_ORDER_EDITOR)
-                
-                # Extract button
-                extract_key = f"extract_{selected_period}_{uploaded_file.name}"
-                
-                if st.session_state.ag_editor_data.empty:
-                    if st.button("Extract Data from PDF", key=extract_key, use_container_width=True):
-                        debug_print("Extract button clicked")
-                        process_pdf_extraction_simple(drive_service)
-                else:
-                    st.success("✅ Data extracted. Review below.")
-                    if st.button("Re-extract Data", key=f"re_{extract_key}", use_container_width=True):
-                        debug_print("Re-extract clicked")
-                        process_pdf_extraction_simple(drive_service)
-        
-        # Data editor
-        if not st.session_state.ag_editor_data.empty:
-            st.markdown("<h4>Review and Edit Data:</h4>", unsafe_allow_html=True)
-            
-            col_config = {
-                "audit_group_number": st.column_config.NumberColumn(disabled=True),
-                "audit_circle_number": st.column_config.NumberColumn(disabled=True),
-                "gstin": st.column_config.TextColumn(width="medium"),
-                "trade_name": st.column_config.TextColumn(width="large"),
-                "category": st.column_config.SelectboxColumn(options=[None] + VALID_CATEGORIES, width="small"),
-                "audit_para_heading": st.column_config.TextColumn("Para Heading", width="xlarge"),
-                "status_of_para": st.column_config.SelectboxColumn("Status", options=[None] + VALID_PARA_STATUSES, width="medium")
-            }
-            
-            editor_key = f"editor_{st.session_state.ag_current_mcm_key}_{st.session_state.ag_current_uploaded_file_name}"
-            
-            edited_df = pd.DataFrame(st.data_editor(
-                st.session_state.ag_editor_data.copy(),
-                column_config=col_config,
-                num_rows="dynamic",
-                key=editor_key,
-                use_container_width=True,
-                hide_index=True
-            ))
-            
-            # Submit button
-            submit_key = f"submit_{st.session_state.ag_current_mcm_key}_{st.session_state.ag_current_uploaded_file_name}"
-            
-            if st.button("Submit to Database", key=submit_key, use_container_width=True):
-                debug_print("Submit clicked")
-                
-                if edited_df.empty:
-                    st.error("No data to submit")
-                else:
-                    # Simple validation
-                    required_cols = ['gstin', 'trade_name', 'audit_para_heading']
-                    df_clean = edited_df.dropna(how='all').reset_index(drop=True)
-                    
-                    if df_clean.empty:
-                        st.error("Only empty rows found")
-                    elif df_clean[required_cols].isnull().any().any():
-                        st.error("Missing required information")
-                    else:
-                        # Would submit to database here
-                        st.success("✅ Data would be submitted to database!")
-                        st.balloons()
+        _upload_tab(active_periods, period_options, drive_service)
     
     elif selected_tab == "View My Uploaded DARs":
         st.markdown("<h3>My Uploaded DARs</h3>", unsafe_allow_html=True)
@@ -2,7 +2,7 @@
 import streamlit as st
 import os
 import base64
-from config import USER_CREDENTIALS, USER_ROLES, AUDIT_GROUP_NUMBERS
+from config import USER_RECORDS
 
 def login_page():
     #st.markdown("<div class='page-main-title'>e-MCM App</div>", unsafe_allow_html=True)
@@ -61,12 +61,14 @@ def login_page():
                              placeholder="Enter your password")
 
     if st.button("Login", key="login_button_styled", use_container_width=True):
-        if username in USER_CREDENTIALS and USER_CREDENTIALS[username] == password:
+        user_record = USER_RECORDS.get(username)
+        if user_record and user_record[0] == password:
+            _, role, audit_group_no = user_record
             st.session_state.logged_in = True
             st.session_state.username = username
-            st.session_state.role = USER_ROLES[username]
-            if st.session_state.role == "AuditGroup":
-                st.session_state.audit_group_no = AUDIT_GROUP_NUMBERS[username]
+            st.session_state.role = role
+            if role == "AuditGroup":
+                st.session_state.audit_group_no = audit_group_no
             st.success(f"Logged in as {username} ({st.session_state.role})")
             st.session_state.drive_structure_initialized = False
             st.rerun()
@@ -22,7 +22,7 @@ from reportlab.pdfgen import canvas
 
 from google_utils import (
     load_mcm_periods, save_mcm_periods, upload_to_drive,
-    append_to_spreadsheet, read_from_spreadsheet, update_spreadsheet_from_df,
+    append_to_spreadsheet, read_from_spreadsheet, read_from_spreadsheet_cached, update_spreadsheet_from_df,
     verify_sheets_access
 )
 from googleapiclient.http import MediaIoBaseDownload
@@ -89,6 +89,15 @@ def create_cover_page_pdf(buffer, title_text, subtitle_text):
     buffer.seek(0)
     return buffer
 
+# High-value table columns, in row order, with the value used when a column is absent
+_HV_TABLE_COLUMNS = {
+    "Audit Group Number": "N/A",
+    "Audit Para Number": "N/A",
+    "Audit Para Heading": "N/A",
+    "Revenue Involved (Lakhs Rs)": 0,
+    "Revenue Recovered (Lakhs Rs)": 0,
+}
+
 def create_high_value_paras_pdf(buffer, df_high_value_paras_data):
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=0.75*inch, rightMargin=0.75*inch, topMargin=0.75*inch, bottomMargin=0.75*inch)
     styles = getSampleStyleSheet()
@@ -98,15 +107,18 @@ def create_high_value_paras_pdf(buffer, df_high_value_paras_data):
     table_data_hv = [[Paragraph("<b>Audit Group</b>", styles['Normal']), Paragraph("<b>Para No.</b>", styles['Normal']),
                       Paragraph("<b>Para Title</b>", styles['Normal']), Paragraph("<b>Detected (₹)</b>", styles['Normal']),
                       Paragraph("<b>Recovered (₹)</b>", styles['Normal'])]]
-    for _, row_hv in df_high_value_paras_data.iterrows():
-        detected_val = row_hv.get('Revenue Involved (Lakhs Rs)', 0) * 100000
-        recovered_val = row_hv.get('Revenue Recovered (Lakhs Rs)', 0) * 100000
+    # Column order fixed up front (absent columns get the old .get defaults); itertuples yields plain
+    # tuples with per-column dtypes instead of boxing every row into a Series
+    missing_hv_cols = {col: default for col, default in _HV_TABLE_COLUMNS.items()
+                       if col not in df_high_value_paras_data.columns}
+    df_hv_rows = df_high_value_paras_data.reindex(columns=list(_HV_TABLE_COLUMNS)).assign(**missing_hv_cols)
+    for group_no, para_no, para_heading, detected_lakhs, recovered_lakhs in df_hv_rows.itertuples(index=False, name=None):
         table_data_hv.append([
-            Paragraph(html.escape(str(row_hv.get("Audit Group Number", "N/A"))), styles['Normal']),
-            Paragraph(html.escape(str(row_hv.get("Audit Para Number", "N/A"))), styles['Normal']),
-            Paragraph(html.escape(str(row_hv.get("Audit Para Heading", "N/A"))[:100]), styles['Normal']),
-            Paragraph(format_inr(detected_val), styles['Normal']),
-            Paragraph(format_inr(recovered_val), styles['Normal'])])
+            Paragraph(html.escape(str(group_no)), styles['Normal']),
+            Paragraph(html.escape(str(para_no)), styles['Normal']),
+            Paragraph(html.escape(str(para_heading)[:100]), styles['Normal']),
+            Paragraph(format_inr(detected_lakhs * 100000), styles['Normal']),
+            Paragraph(format_inr(recovered_lakhs * 100000), styles['Normal'])])
 
     col_widths_hv = [1*inch, 0.7*inch, 3*inch, 1.4*inch, 1.4*inch]
     hv_table = Table(table_data_hv, colWidths=col_widths_hv)
@@ -130,6 +142,36 @@ def calculate_audit_circle_agenda(audit_group_number_val):
     except (ValueError, TypeError, AttributeError):
         return 0
 
+# Tab menu styling, defined once rather than rebuilt on every rerun
+_OPTION_MENU_STYLES = {
+    "container": {"padding": "5px !important", "background-color": "#e9ecef"},
+    "icon": {"color": "#007bff", "font-size": "20px"},
+    "nav-link": {"font-size": "16px", "text-align": "center", "margin": "0px", "--hover-color": "#d1e7fd"},
+    "nav-link-selected": {"background-color": "#007bff", "color": "white"},
+}
+
+DISPLAY_PAGE_ROWS = 500
+
+def page_start_row(df, key):
+    """First row of the DISPLAY_PAGE_ROWS window to render; frames longer than a page get a start-row slider"""
+    if len(df) <= DISPLAY_PAGE_ROWS:
+        return 0
+    start = st.slider("Start row", 0, len(df) - DISPLAY_PAGE_ROWS, 0, key=f"{key}_start")
+    st.caption(f"Showing rows {start + 1}-{start + DISPLAY_PAGE_ROWS} of {len(df)}")
+    return start
+
+def display_dataframe_paged(df, key):
+    """Read-only st.dataframe capped at DISPLAY_PAGE_ROWS rows"""
+    start = page_start_row(df, key)
+    df = df.iloc[start:start + DISPLAY_PAGE_ROWS]
+    column_config = None
+    if 'DAR PDF URL' in df.columns:
+        # Failed Drive uploads store "#placeholder-<file>" - show those as empty rather than as a dead link
+        urls = df['DAR PDF URL']
+        df = df.assign(**{'DAR PDF URL': urls.where(~urls.astype(str).str.startswith('#placeholder-'))})
+        column_config = {'DAR PDF URL': st.column_config.LinkColumn('DAR PDF URL', display_text='View PDF')}
+    st.dataframe(df, column_config=column_config, use_container_width=True)
+
 def pco_dashboard(drive_service, sheets_service):
     st.markdown("<div class='sub-header'>Planning & Coordination Officer Dashboard</div>", unsafe_allow_html=True)
     
@@ -168,12 +210,7 @@ def pco_dashboard(drive_service, sheets_service):
         menu_icon="gear-wide-connected", 
         default_index=0,
         orientation="horizontal",
-        styles={
-            "container": {"padding": "5px !important", "background-color": "#e9ecef"},
-            "icon": {"color": "#007bff", "font-size": "20px"},
-            "nav-link": {"font-size": "16px", "text-align": "center", "margin": "0px", "--hover-color": "#d1e7fd"},
-            "nav-link-selected": {"background-color": "#007bff", "color": "white"},
-        })
+        styles=_OPTION_MENU_STYLES)
 
     st.markdown("<div class='card'>", unsafe_allow_html=True)
 
@@ -295,7 +332,7 @@ def pco_dashboard(drive_service, sheets_service):
         
         # Load data from centralized database
         with st.spinner("Loading data from Master DAR Database..."):
-            df_all_data = read_from_spreadsheet(sheets_service)
+            df_all_data = read_from_spreadsheet_cached(sheets_service)
         
         if df_all_data is not None and not df_all_data.empty:
             # Filter by MCM Period if available
@@ -355,16 +392,21 @@ def pco_dashboard(drive_service, sheets_service):
                         st.markdown("<h4>Edit Detailed Data</h4>", unsafe_allow_html=True)
                         st.info("You can edit data in the table below. Click 'Save Changes' to update the Master DAR Database.", icon="✍️")
 
-                        edited_df = st.data_editor(
-                            df_filtered,
+                        # Only one page is rendered; save before moving the slider or that page's edits are lost
+                        page_start = page_start_row(df_filtered, key="editor_centralized_master")
+                        page_end = page_start + DISPLAY_PAGE_ROWS
+                        edited_page = st.data_editor(
+                            df_filtered.iloc[page_start:page_end],
                             use_container_width=True,
                             hide_index=True,
                             num_rows="dynamic",
-                            key="editor_centralized_master"
+                            key=f"editor_centralized_master_{page_start}"
                         )
 
                         if st.button("Save Changes to Master Database", type="primary"):
                             with st.spinner("Saving changes to Master DAR Database..."):
+                                # Rows outside the edited page are written back unchanged
+                                edited_df = pd.concat([df_filtered.iloc[:page_start], edited_page, df_filtered.iloc[page_end:]])
                                 success = update_spreadsheet_from_df(sheets_service, edited_df)
                                 if success:
                                     st.success("Changes saved successfully to Master DAR Database!")
@@ -377,7 +419,7 @@ def pco_dashboard(drive_service, sheets_service):
                         st.error(f"Error processing summary: {e_rep_sum}")
                 else:
                     st.warning("Missing 'Audit Group Number' column for summary.")
-                    st.dataframe(df_filtered, use_container_width=True)
+                    display_dataframe_paged(df_filtered, key="pco_view_raw_rows")
             else:
                 st.info("No data found for the selected filter.")
         elif df_all_data is None:
@@ -392,7 +434,7 @@ def pco_dashboard(drive_service, sheets_service):
         
         # Load data from centralized database
         with st.spinner("Loading data from Master DAR Database..."):
-            df_all_data = read_from_spreadsheet(sheets_service)
+            df_all_data = read_from_spreadsheet_cached(sheets_service)
         
         if df_all_data is not None and not df_all_data.empty:
             # Filter by MCM Period for agenda
@@ -424,7 +466,7 @@ def pco_dashboard(drive_service, sheets_service):
         
         # Load data from centralized database
         with st.spinner("Loading data from Master DAR Database..."):
-            df_all_data = read_from_spreadsheet(sheets_service)
+            df_all_data = read_from_spreadsheet_cached(sheets_service)
         
         if df_all_data is not None and not df_all_data.empty:
             # Filter by MCM Period if available
@@ -449,10 +491,12 @@ def pco_dashboard(drive_service, sheets_service):
             if not df_viz_data.empty:
                 # Data cleaning and preparation
                 viz_amount_cols = ['Total Amount Detected (Overall Rs)', 'Total Amount Recovered (Overall Rs)', 'Revenue Involved (Lakhs Rs)', 'Revenue Recovered (Lakhs Rs)']
-                for v_col in viz_amount_cols:
-                    if v_col in df_viz_data.columns:
-                        df_viz_data[v_col] = df_viz_data[v_col].astype(str).str.replace(r'[^\d.]', '', regex=True)
-                        df_viz_data[v_col] = pd.to_numeric(df_viz_data[v_col], errors='coerce').fillna(0)
+                # Clean and convert all present columns as one sub-frame, assigned back in a single block write
+                viz_present_cols = [v_col for v_col in viz_amount_cols if v_col in df_viz_data.columns]
+                if viz_present_cols:
+                    df_viz_data[viz_present_cols] = df_viz_data[viz_present_cols].apply(
+                        lambda col: pd.to_numeric(col.astype(str).str.replace(r'[^\d.]', '', regex=True), errors='coerce')
+                    ).fillna(0)
                 
                 if 'Audit Group Number' in df_viz_data.columns:
                     df_viz_data['Audit Group Number'] = pd.to_numeric(df_viz_data['Audit Group Number'], errors='coerce').fillna(0).astype(int)
@@ -520,16 +564,19 @@ def display_mcm_agenda_centralized(df_period_data, drive_service, sheets_service
     cols_to_convert_numeric = ['Audit Group Number', 'Audit Circle Number', 'Total Amount Detected (Overall Rs)', 
                                'Total Amount Recovered (Overall Rs)', 'Audit Para Number', 
                                'Revenue Involved (Lakhs Rs)', 'Revenue Recovered (Lakhs Rs)']
-    for col_name in cols_to_convert_numeric:
-        if col_name in df_period_data.columns:
-            df_period_data[col_name] = df_period_data[col_name].astype(str).str.replace(r'[^\d.]', '', regex=True)
-            df_period_data[col_name] = pd.to_numeric(df_period_data[col_name], errors='coerce').fillna(0)
+    present_numeric_cols = [col_name for col_name in cols_to_convert_numeric if col_name in df_period_data.columns]
+    if present_numeric_cols:  # One apply over the sub-frame and one block assignment instead of a write per column
+        df_period_data[present_numeric_cols] = df_period_data[present_numeric_cols].apply(
+            lambda col: pd.to_numeric(col.astype(str).str.replace(r'[^\d.]', '', regex=True), errors='coerce')
+        ).fillna(0)
 
     # Derive/Validate Audit Circle Number
     circle_col_to_use = 'Audit Circle Number'
     if 'Audit Circle Number' not in df_period_data.columns or not df_period_data['Audit Circle Number'].notna().any():
         if 'Audit Group Number' in df_period_data.columns and df_period_data['Audit Group Number'].notna().any():
-            df_period_data['Derived Audit Circle Number'] = df_period_data['Audit Group Number'].apply(calculate_audit_circle_agenda).fillna(0).astype(int)
+            # Vectorised calculate_audit_circle_agenda: truncate like int(), ceil(group / 3) for groups 1-30, else 0
+            group_numbers = pd.to_numeric(df_period_data['Audit Group Number'], errors='coerce').fillna(0).astype(int)
+            df_period_data['Derived Audit Circle Number'] = ((group_numbers + 2) // 3).where(group_numbers.between(1, 30), 0)
             circle_col_to_use = 'Derived Audit Circle Number'
         else:
             df_period_data['Derived Audit Circle Number'] = 0
@@ -707,18 +754,22 @@ def display_mcm_agenda_centralized(df_period_data, drive_service, sheets_service
                                         if 'MCM Decision' not in current_df.columns:
                                             current_df['MCM Decision'] = ""
                                         
-                                        # Update decisions for this trade name
-                                        for index, row in df_trade_paras.iterrows():
-                                            para_num_str = str(int(row["Audit Para Number"])) if pd.notna(row["Audit Para Number"]) and row["Audit Para Number"] != 0 else "N/A"
-                                            decision_key = f"mcm_decision_{trade_name}_{para_num_str}_{index}"
-                                            selected_decision = st.session_state.get(decision_key, decision_options[0])
-                                            
+                                        # Update decisions for this trade name; the trade/period mask and the
+                                        # para numbers as strings are computed once, not per para
+                                        trade_period_mask = ((current_df['Trade Name'] == trade_name) &
+                                                             (current_df['MCM Period'] == selected_period)).values
+                                        para_numbers_str = current_df['Audit Para Number'].astype(str).values
+                                        # Para number -> chosen decision, read straight from the index/column (no per-row Series);
+                                        # a repeated para number keeps the last decision, as the row loop did
+                                        para_strs = [str(int(para_no)) if pd.notna(para_no) and para_no != 0 else "N/A"
+                                                     for para_no in df_trade_paras["Audit Para Number"]]
+                                        decisions_by_para = {
+                                            para_num_str: st.session_state.get(f"mcm_decision_{trade_name}_{para_num_str}_{index}", decision_options[0])
+                                            for index, para_num_str in zip(df_trade_paras.index, para_strs)
+                                        }
+                                        for para_num_str, selected_decision in decisions_by_para.items():
                                             # Find matching rows in the current dataframe
-                                            mask = (
-                                                (current_df['Trade Name'] == trade_name) &
-                                                (current_df['MCM Period'] == selected_period) &
-                                                (current_df['Audit Para Number'].astype(str) == para_num_str)
-                                            )
+                                            mask = trade_period_mask & (para_numbers_str == para_num_str)
                                             current_df.loc[mask, 'MCM Decision'] = selected_decision
                                         
                                         success = update_spreadsheet_from_df(sheets_service, current_df)